@@ -0,0 +1,92 @@
+import click
+import os
+from extensions import db
+from services.rating_service import RatingService
+from services.pageview_service import PageViewService
+from services.indexing_service import IndexingService, INDEX_DEFINITIONS
+from services.search_outbox_service import search_outbox
+from services.location_service import LocationService
+
+
+def register_commands(app):
+    """Registers the maintenance `flask` CLI commands."""
+    # `flask db ...` only; alembic stays out of the web workers
+    if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    @app.cli.command("rebuild-rating-stats")
+    def rebuild_rating_stats():
+        """Backfill/repair course/user rating stats and ratings from comments."""
+        rows = RatingService.rebuild_course_stats()
+        click.echo(f"Rebuilt rating stats for {rows} courses.")
+        rows = RatingService.rebuild_user_stats()
+        click.echo(f"Rebuilt rating stats for {rows} tutors/academies.")
+
+    @app.cli.command("rebuild-page-view-rollups")
+    def rebuild_page_view_rollups():
+        """Backfill/repair the hour/day page view rollups from page_view."""
+        rows = PageViewService.rebuild_rollups(app.config.get("PAGE_VIEW_VIEWER_RETENTION_DAYS", 2))
+        click.echo(f"Rebuilt {rows} page view rollup buckets.")
+
+    @app.cli.command("rebuild-page-view-sketches")
+    def rebuild_page_view_sketches():
+        """Backfill/repair the per-day unique viewer sketches from page_view."""
+        rows = PageViewService.rebuild_sketches()
+        click.echo(f"Rebuilt {rows} page view sketches.")
+
+    @app.cli.command("backfill-locations")
+    def backfill_locations():
+        """Create city/district rows from courses/users and link them (coordinates are left as they are)."""
+        cities, districts = LocationService.backfill()
+        click.echo(f"Linked {cities} cities and {districts} districts. "
+                   f"Run `flask reindex` to refresh the search documents.")
+
+    @app.cli.group("search-index")
+    def search_index():
+        """Manage the versioned Elasticsearch indices behind their aliases."""
+
+    @search_index.command("ensure")
+    def ensure_search_indices():
+        """Create missing indices (current version) and their aliases."""
+        IndexingService.ensure_indices()
+        click.echo("Search indices are in place.")
+
+    @search_index.command("migrate")
+    @click.argument("alias", type=click.Choice(sorted(INDEX_DEFINITIONS)))
+    def migrate_search_index(alias):
+        """Build the current version of ALIAS from Postgres and swap the alias."""
+        name, indexed = IndexingService.migrate_index(alias)
+        click.echo(f"Alias '{alias}' now points to {name} ({indexed} documents indexed from Postgres).")
+
+    @app.cli.command("reindex")
+    @click.argument("aliases", nargs=-1, type=click.Choice(sorted(INDEX_DEFINITIONS)))
+    @click.option("--chunk-size", default=500, show_default=True, help="Rows per fetch and documents per bulk request.")
+    @click.option("--threads", default=1, show_default=True, help="Parallel bulk requests (parallel_bulk when > 1).")
+    @click.option("--checkpoint", "checkpoint_path", default=".reindex-checkpoint.json", show_default=True,
+                  help="File recording the last fully indexed id per index.")
+    @click.option("--resume", is_flag=True, help="Continue after the checkpointed id instead of starting over.")
+    def reindex(aliases, chunk_size, threads, checkpoint_path, resume):
+        """Rebuild users/courses documents (default: both) from Postgres with the bulk API."""
+        for alias in aliases or sorted(INDEX_DEFINITIONS):
+            def progress(indexed, failed, rate):
+                click.echo(f"  {alias}: {indexed} indexed, {failed} failed, {rate:.0f} docs/s")
+
+            result = IndexingService.reindex(alias, chunk_size=chunk_size, threads=threads,
+                                             checkpoint_path=checkpoint_path, resume=resume, progress=progress)
+            click.echo(
+                f"Reindexed {alias}: {result['indexed']} documents, {result['skipped']} already newer, "
+                f"{result['failed']} failed, "
+                f"{result['seconds']}s ({result['docs_per_sec']} docs/s), last id {result['last_id']}."
+            )
+
+    @app.cli.command("dispatch-search-outbox")
+    def dispatch_search_outbox():
+        """Send every due search_outbox row to Elasticsearch now."""
+        dispatched = 0
+        while True:
+            claimed = search_outbox.dispatch_batch()
+            dispatched += claimed
+            if claimed < search_outbox.batch_size:
+                break
+        click.echo(f"Processed {dispatched} search outbox rows ({search_outbox.stats()['failed']} failed).")
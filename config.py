@@ -1,4 +1,5 @@
 import os 
+from utils.db_pool import engine_options, replica_binds
 class Config:
     """Base configuration for the app."""
     # Secret key for session management and JWT signing
@@ -8,6 +9,77 @@ class Config:
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'postgresql://postgres:12@pgbouncer:6432/test1')
     SQLALCHEMY_TRACK_MODIFICATIONS = False  # To disable modification tracking (to save memory)
+    # Engine/pool profile (see utils/db_pool.py): the default URL goes through pgbouncer in transaction mode
+    DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'queue')  # 'queue' (small pool per worker) or 'null' (pgbouncer pools)
+    DB_BEHIND_PGBOUNCER = os.getenv('DB_BEHIND_PGBOUNCER', 'auto')  # 'true', 'false' or 'auto' (port 6432)
+    DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 100))  # pgbouncer max_client_conn, shared by all workers
+    DB_RESERVED_CONNECTIONS = int(os.getenv('DB_RESERVED_CONNECTIONS', 10))  # left for CLI/migrations/cron
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE')) if os.getenv('DB_POOL_SIZE') else None  # unset = derived
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))  # seconds waiting for a connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # seconds
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ['true', '1', 'yes']
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI, mode=DB_POOL_MODE, behind_pgbouncer=DB_BEHIND_PGBOUNCER,
+        max_connections=DB_MAX_CONNECTIONS, reserved=DB_RESERVED_CONNECTIONS, pool_size=DB_POOL_SIZE,
+        pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE, pre_ping=DB_POOL_PRE_PING,
+    )
+    # Read replicas for @read_only service methods (see utils/db_routing.py), comma-separated URLs
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    SQLALCHEMY_BINDS = replica_binds(
+        DATABASE_REPLICA_URLS, mode=DB_POOL_MODE, behind_pgbouncer=DB_BEHIND_PGBOUNCER,
+        max_connections=DB_MAX_CONNECTIONS, reserved=DB_RESERVED_CONNECTIONS, pool_size=DB_POOL_SIZE,
+        pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE, pre_ping=DB_POOL_PRE_PING,
+    )
+    DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', 2.0))  # past it, reads go to the primary
+    DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', 1.0))  # seconds
+    DB_REPLICA_STICKY_SECONDS = float(os.getenv('DB_REPLICA_STICKY_SECONDS', 5.0))  # reads of a writer stay on the primary
+    ELASTICSEARCH_URL = os.getenv('ELASTICSEARCH_URL', 'http://elasticsearch:9200')
+    # Window (in seconds) in which course/user rating recomputes are coalesced
+    RATING_RECOMPUTE_DELAY = float(os.getenv('RATING_RECOMPUTE_DELAY', 2.0))
+
+    # How paginated endpoints compute `total`: 'exact', 'cached' or 'estimate' (see utils/counting.py)
+    COUNT_STRATEGIES = {
+        'top_courses': 'cached',
+        'top_users': 'cached',
+        'my_courses': 'exact',
+        'my_comments': 'exact',
+        'course_comments': 'exact',
+        'page_views': 'estimate',
+        'search_users': 'exact',
+        'search_courses': 'exact',
+        'favorites': 'exact',
+    }
+    COUNT_CACHE_TTL = int(os.getenv('COUNT_CACHE_TTL', 60))  # seconds
+    COUNT_ESTIMATE_THRESHOLD = int(os.getenv('COUNT_ESTIMATE_THRESHOLD', 10000))  # rows
+
+    # Networks allowed to read /metrics directly (not through nginx), comma-separated CIDRs
+    METRICS_ALLOWED_NETWORKS = [n.strip() for n in os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.1/32,::1/128').split(',')
+                                if n.strip()]
+
+    # Page view ingestion buffer (see PageViewBuffer)
+    PAGE_VIEW_BUFFER_SIZE = int(os.getenv('PAGE_VIEW_BUFFER_SIZE', 10000))  # events
+    PAGE_VIEW_BATCH_SIZE = int(os.getenv('PAGE_VIEW_BATCH_SIZE', 500))  # events per INSERT
+    PAGE_VIEW_FLUSH_INTERVAL_MS = int(os.getenv('PAGE_VIEW_FLUSH_INTERVAL_MS', 500))
+    PAGE_VIEW_VIEWER_RETENTION_DAYS = int(os.getenv('PAGE_VIEW_VIEWER_RETENTION_DAYS', 2))  # exact bucket viewers kept
+    PAGE_VIEW_VIEWER_PRUNE_INTERVAL = int(os.getenv('PAGE_VIEW_VIEWER_PRUNE_INTERVAL', 3600))  # seconds
+
+    # Postgres -> Elasticsearch sync through the search_outbox table (see SearchOutboxDispatcher)
+    SEARCH_OUTBOX_BATCH_SIZE = int(os.getenv('SEARCH_OUTBOX_BATCH_SIZE', 500))  # rows per bulk request
+    SEARCH_OUTBOX_POLL_INTERVAL_MS = int(os.getenv('SEARCH_OUTBOX_POLL_INTERVAL_MS', 1000))
+    SEARCH_OUTBOX_MAX_ATTEMPTS = int(os.getenv('SEARCH_OUTBOX_MAX_ATTEMPTS', 10))
+
+    # In-process cache of /search/suggest results for short (most common) prefixes
+    SUGGEST_CACHE_TTL = int(os.getenv('SUGGEST_CACHE_TTL', 30))  # seconds
+    SUGGEST_CACHE_MAX_PREFIX = int(os.getenv('SUGGEST_CACHE_MAX_PREFIX', 4))  # characters
+
+    # Cached course/profile payloads (see utils/cache.py)
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() in ['true', '1', 'yes']
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))  # per worker
+    CACHE_TTL = int(os.getenv('CACHE_TTL', 300))  # seconds
+    CACHE_LOCAL_TTL = int(os.getenv('CACHE_LOCAL_TTL', 30))  # seconds, bounds cross-worker staleness
+    CACHE_SHARED_URL = os.getenv('CACHE_SHARED_URL')  # "redis://..." or "local", unset = no shared level
+    # Per-user favorite id sets used for is_favorite (invalidated on add/delete, shared level through CACHE_SHARED_URL)
+    FAVORITES_CACHE_TTL = int(os.getenv('FAVORITES_CACHE_TTL', 5))  # seconds, in-worker level
     
     # OAuth keys for Google and Apple (can be set in environment variables)
     GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
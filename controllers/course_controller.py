@@ -7,6 +7,8 @@ from models.user import Course
 import os
 from models.user import Course
 from werkzeug.utils import secure_filename
+from utils.pagination import cursor_args
+from utils.geo import parse_near
 
 course_bp = Blueprint('course', __name__)
 
@@ -17,17 +19,18 @@ def user_courses(user_id):
         # Get pagination parameters
         page = request.args.get('page', 1, type=int)  # Default to page 1
         per_page = request.args.get('per_page', 10, type=int)
+        cursor, with_total = cursor_args(request.args)
 
         # Create an instance of CourseService
         course_service = CourseService(user_id=user_id)
 
         # Fetch courses for the given user ID
-        courses = course_service.get_my_courses(page=page, per_page=per_page)
+        courses = course_service.get_my_courses(page=page, per_page=per_page, cursor=cursor, with_total=with_total)
 
         # Return the course info
         return jsonify(courses), 200
 
-    except BadRequest as error:
+    except (BadRequest, ValueError) as error:
         return jsonify({"msg": str(error)}), 400
     except Exception as error:
         print(error)
@@ -43,15 +46,16 @@ def mycourses():
         
         page = request.args.get('page', 1, type=int)  # Default to page 1 if not specified
         per_page = request.args.get('per_page', 10, type=int)
+        cursor, with_total = cursor_args(request.args)
         # Create an instance of CourseService
         course_service = CourseService(user_id=user_id, role=role)
         
-        courses = course_service.get_my_courses(page=page,per_page=per_page)
+        courses = course_service.get_my_courses(page=page,per_page=per_page, cursor=cursor, with_total=with_total)
         
         # Return the course info
         return jsonify(courses), 200
         
-    except BadRequest as error:
+    except (BadRequest, ValueError) as error:
         return jsonify({"msg": str(error)}), 400
     except Exception as error:
         print(error)
@@ -69,14 +73,16 @@ def get_all_comments_for_my_courses():
 
         page = request.args.get('page', 1, type=int)  # Default to page 1 if not specified
         per_page = request.args.get('per_page', 10, type=int)
+        cursor, with_total = cursor_args(request.args)
         
         course_service = CourseService(user_id=user_id, role=role)
         
-        comments = course_service.get_all_comments_by_user_role(page=page,per_page=per_page)
+        comments = course_service.get_all_comments_by_user_role(page=page,per_page=per_page,
+                                                                cursor=cursor, with_total=with_total)
         # Return the course info
         return jsonify(comments), 200
         
-    except BadRequest as error:
+    except (BadRequest, ValueError) as error:
         return jsonify({"msg": str(error)}), 400
     except Exception as error:
         print(error)
@@ -116,11 +122,12 @@ def get_comments_by_course(course_id):
         course_service = CourseService(user_id, role)
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
+        cursor, with_total = cursor_args(request.args)
         
-        comments = course_service.get_comments_by_course(course_id, page, per_page)
+        comments = course_service.get_comments_by_course(course_id, page, per_page, cursor=cursor, with_total=with_total)
         return jsonify(comments), 200
         
-    except BadRequest as error:
+    except (BadRequest, ValueError) as error:
         return jsonify({"msg": str(error)}), 400
     except Exception as error:
         print(error)
@@ -218,6 +225,9 @@ def get_top_courses_route():
 
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
+        cursor, with_total = cursor_args(request.args)
+        # Optional "near me": lat, lon, radius_km
+        near = parse_near(request.args)
 
         result = CourseService.get_top_courses(
             user_id=user_id,
@@ -227,11 +237,16 @@ def get_top_courses_route():
             min_rating=min_rating,
             online=online,
             page=page,
-            per_page=per_page
+            per_page=per_page,
+            cursor=cursor,
+            with_total=with_total,
+            near=near
         )
         log(result)
         return jsonify(result), 200
 
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
     except Exception as e:
         return jsonify({"msg": f"Unexpected error: {str(e)}"}), 500
 
@@ -1,6 +1,7 @@
 from flask import Blueprint, request
 from services.favorites_service import FavoritesService
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from utils.pagination import cursor_args
 
 favorites_bp = Blueprint('favorites', __name__)
 
@@ -30,8 +31,15 @@ def add_favorite():
 @favorites_bp.route('', methods=['GET'])
 @jwt_required()
 def get_favorites():
+    """
+    Query params: cursor (next_cursor of the previous page), per_page, with_total.
+    """
     user_id = get_jwt_identity()
-    return FavoritesService.get_favorites_for_user(user_id)
+    cursor, with_total = cursor_args(request.args)
+    # Non-integer values fall back to the default; clamped to 1..200
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+    return FavoritesService.get_favorites_for_user(user_id, cursor=cursor, per_page=per_page,
+                                                   with_total=with_total)
 
 @favorites_bp.route('', methods=['DELETE'])
 @jwt_required()
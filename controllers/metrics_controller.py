@@ -0,0 +1,28 @@
+import ipaddress
+from flask import Blueprint, jsonify, request, current_app, abort
+from utils.metrics import collect_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def _from_internal_network():
+    """
+    True for direct requests (not forwarded by nginx) from METRICS_ALLOWED_NETWORKS.
+    nginx also refuses /metrics, so public clients never reach it.
+    """
+    if request.headers.get('X-Forwarded-For') or request.headers.get('X-Real-IP'):
+        return False
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in current_app.config.get('METRICS_ALLOWED_NETWORKS', ['127.0.0.1/32', '::1/128']))
+
+
+@metrics_bp.route('', methods=['GET'])
+def get_metrics():
+    """In-process counters of this worker (buffers, queues, caches, pools), internal network only."""
+    if not _from_internal_network():
+        abort(403, description="Metrics are only served to the internal network.")
+    return jsonify(collect_metrics()), 200
@@ -1,29 +1,46 @@
 from flask import Blueprint, request, jsonify
 from services.pageview_service import PageViewService
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from utils.pagination import cursor_args
 
 
 page_view_bp = Blueprint('page_view', __name__)
 
 
-# @page_view_bp.route('', methods=['POST'])
-# @jwt_required()
-# def add_page_view():
-#     data = request.json
-#     viewed_user_id = data.get('viewed_user_id')
-#     viewer_user_id = get_jwt_identity()
+@page_view_bp.route('/count', methods=['GET'])
+@jwt_required()
+def get_views_for_user():
+    user_id = get_jwt_identity()
+    start = request.args.get('start', None)
+    end = request.args.get('end', None)
+    return PageViewService.get_views_count_for_user(user_id, start=start, end=end)
 
-#     if not viewed_user_id or not viewer_user_id:
-#         return jsonify({'msg': 'Both viewed_user_id and viewer_user_id are required'}), 400
 
-#     return PageViewService.add_page_view(viewed_user_id, viewer_user_id)
+@page_view_bp.route('/timeseries', methods=['GET'])
+@jwt_required()
+def get_views_timeseries():
+    """
+    Views per hour/day bucket from the page view rollups.
+    Query params: granularity ('day' default or 'hour'), start, end (ISO timestamps).
+    """
+    user_id = get_jwt_identity()
+    granularity = request.args.get('granularity', 'day')
+    start = request.args.get('start', None)
+    end = request.args.get('end', None)
+    return PageViewService.get_views_timeseries(user_id, granularity=granularity, start=start, end=end)
 
 
-@page_view_bp.route('/count', methods=['GET'])
+@page_view_bp.route('/unique', methods=['GET'])
 @jwt_required()
-def get_views_for_user():
+def get_unique_viewers():
+    """
+    Approximate unique visitors (HyperLogLog) between start and end days.
+    Query params: start, end (ISO dates, inclusive; default is the last 7 days).
+    """
     user_id = get_jwt_identity()
-    return PageViewService.get_views_count_for_user(user_id)
+    start = request.args.get('start', None)
+    end = request.args.get('end', None)
+    return PageViewService.get_unique_viewers(user_id, start=start, end=end)
 
 
 @page_view_bp.route('', methods=['GET'])
@@ -39,6 +56,7 @@ def get_views_count_for_user():
             page_size = int(request.args.get('page_size', 10))  # Default page size is 10
             start_timestamp = request.args.get('start_timestamp', None)
             end_timestamp = request.args.get('end_timestamp', None)
+            cursor, with_total = cursor_args(request.args)
 
             # Call service function
             result, status = PageViewService.get_views_for_user(
@@ -46,7 +64,9 @@ def get_views_count_for_user():
                 page=page,
                 page_size=page_size,
                 start_timestamp=start_timestamp,
-                end_timestamp=end_timestamp
+                end_timestamp=end_timestamp,
+                cursor=cursor,
+                with_total=with_total
             )
             return result, status
         except ValueError as e:
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from services.user_service import UserService
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from services.search_service import SearchService
+from utils.geo import parse_near
 
 search_bp = Blueprint("search", __name__)
 
@@ -16,6 +17,9 @@ def get_user_profiles():
         per_page = int(request.args.get("per_page", 10))
         sort_by_rating = request.args.get("sort_by_rating", None)  # "asc" or "desc"
         location = request.args.get("location", None)
+        min_rating = float(request.args.get("min_rating", 0))
+        # Optional "near me": lat, lon, radius_km
+        near = parse_near(request.args)
 
         # Call the search service with the extracted parameters
         users = SearchService.search_users(
@@ -24,7 +28,9 @@ def get_user_profiles():
             page=page,
             per_page=per_page,
             sort_by_rating=sort_by_rating,
-            location=location
+            location=location,
+            min_rating=min_rating,
+            near=near
         )
 
         if not users:
@@ -52,6 +58,8 @@ def get_courses():
         district = request.args.get("district", None)
         start_time = request.args.get("start_time", None)
         end_time = request.args.get("end_time", None)
+        # Optional "near me": lat, lon, radius_km
+        near = parse_near(request.args)
 
         # Call the search service with the extracted parameters
         courses = SearchService.search_courses(
@@ -65,7 +73,8 @@ def get_courses():
             city=city,
             district=district,
             start_time=start_time,
-            end_time=end_time
+            end_time=end_time,
+            near=near
         )
 
         if not courses:
@@ -79,3 +88,18 @@ def get_courses():
         return jsonify({"msg": f"Server error: {str(e)}"}), 500
 
 
+
+
+@search_bp.route('/suggest', methods=['GET'])
+@jwt_required()
+def get_suggestions():
+    """
+    Search-as-you-type suggestions for course titles and tutor/academy names.
+    Query params: prefix, size (default 5, max 20).
+    """
+    try:
+        prefix = request.args.get("prefix", None)
+        size = int(request.args.get("size", 5))
+        return jsonify(SearchService.suggest(prefix, size=size)), 200
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
@@ -6,6 +6,8 @@ import base64
 from services.pageview_service import PageViewService
 import os
 from flask import send_from_directory, abort, current_app
+from utils.pagination import cursor_args
+from utils.geo import parse_near
 
 user_bp = Blueprint("user", __name__)
 
@@ -27,6 +29,8 @@ def update_user_profile():
         update_data = request.json  # Expects a JSON object
         updated_profile = UserService.update_user(user_id, update_data)
         return jsonify(updated_profile), 200
+    except BadRequest as e:
+        return jsonify({"msg": e.description}), 400
     except ValueError as e:
         return jsonify({"msg": str(e)}), 404
 
@@ -61,7 +65,7 @@ def get_the_user_by_id(viewed_user_id):
         #viewed_user_id, viewer_user_id
         viewer_user_id = get_jwt_identity()
         user = UserService.get_profile(user_id=viewed_user_id)
-        PageViewService.add_page_view(viewed_user_id, viewer_user_id)
+        PageViewService.record_page_view(viewed_user_id, viewer_user_id)
         # Return the course info
         return jsonify(user), 200
     except BadRequest as error:
@@ -81,6 +85,9 @@ def get_top_users_route():
         min_rating = float(request.args.get('min_rating', 0))
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
+        cursor, with_total = cursor_args(request.args)
+        # Optional "near me": lat, lon, radius_km
+        near = parse_near(request.args)
 
         result = UserService.get_top_users(
             user_id=user_id,
@@ -89,7 +96,10 @@ def get_top_users_route():
             degree=degree,
             min_rating=min_rating,
             page=page,
-            per_page=per_page
+            per_page=per_page,
+            cursor=cursor,
+            with_total=with_total,
+            near=near
         )
 
         return jsonify(result), 200
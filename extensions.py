@@ -1,7 +1,50 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
-from elasticsearch import Elasticsearch
+from utils.db_routing import RoutingSession
+import os
+import threading
 
-db = SQLAlchemy()
+
+class ProcessLocalElasticsearch:
+    """
+    Elasticsearch client proxy: the client (and the elasticsearch package)
+    is only loaded on first use, and rebuilt in every forked process, so
+    gunicorn workers never share the connection pool of the master (or of
+    each other). init_app() takes the URL from ELASTICSEARCH_URL.
+    """
+
+    def __init__(self, hosts="http://elasticsearch:9200"):
+        self._hosts = hosts
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # A lock held by another thread at fork time would stay locked in the child
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        hosts = app.config.get("ELASTICSEARCH_URL", self._hosts)
+        if hosts != self._hosts:
+            with self._lock:
+                self._hosts = hosts
+                self._client = None
+
+    def get_client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    from elasticsearch import Elasticsearch
+                    self._client = Elasticsearch(self._hosts)
+                    self._pid = os.getpid()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+
+# Primary by default, read replicas for @read_only service methods
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 jwt = JWTManager()
-es = Elasticsearch("http://elasticsearch:9200")
\ No newline at end of file
+es = ProcessLocalElasticsearch()
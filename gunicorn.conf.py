@@ -0,0 +1,74 @@
+"""
+Gunicorn settings: `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+The app is imported once in the master (preload_app) and the workers are
+forked from it. Nothing in the master talks to Postgres or Elasticsearch
+except the index check in when_ready; post_fork drops any inherited DB
+connection and the ES client is rebuilt per process (see extensions.py),
+as are the background threads (page view buffer, search outbox).
+
+Reloads: `kill -HUP <master>` restarts the workers gracefully with the
+preloaded code. To deploy new code without downtime send USR2 (starts a
+new master with the new code), then WINCH and TERM to the old master.
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5002")
+
+# "gthread" (default), "gevent" (needs the gevent package) or "sync"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gevent":
+    # Patch before the app (and its locks/sockets) is preloaded
+    from gevent import monkey
+    monkey.patch_all()
+
+from utils.db_pool import gunicorn_worker_count  # noqa: E402
+
+# 2 x CPUs available + 1; the DB pool of each worker is sized from the same count
+workers = gunicorn_worker_count()
+threads = int(os.getenv("GUNICORN_THREADS", 4))  # gthread only
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))  # gevent only
+
+preload_app = True
+
+# Recycle workers to bound memory growth; jitter avoids restarting them all at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    from wsgi import app
+    from services.indexing_service import IndexingService
+    with app.app_context():
+        try:
+            IndexingService.ensure_indices()
+        except Exception as e:
+            server.log.warning(f"Elasticsearch indices not checked: {e}")
+
+
+def post_fork(server, worker):
+    from wsgi import app
+    from extensions import db
+    # Connections opened in the master must not be used by the workers;
+    # close=False leaves them to the master instead of closing its sockets
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    # Write what is still buffered in this worker before it goes away
+    from wsgi import app
+    from services.pageview_service import page_view_buffer
+    from services.rating_service import rating_queue
+    with app.app_context():
+        page_view_buffer.drain()
+        rating_queue.flush()
@@ -0,0 +1,96 @@
+"""indexes for the hot filters and sorts
+
+Composite indexes matching the (filter, sort, id) of every paginated
+query, plus pg_trgm GIN indexes for the remaining ILIKE '%...%' filters,
+and the indexes on the location columns added by 3b7c2d9a5f14, whose
+NOT VALID foreign keys are validated here as well. Indexes are built
+CONCURRENTLY, outside the migration transaction, so the tables stay
+writable while they build. A build that failed half way leaves an
+INVALID index behind; it is dropped and rebuilt on the next run. Check
+the plans afterwards with `python scripts/check_query_plans.py`.
+
+Revision ID: 6968867e68db
+Revises: 3b7c2d9a5f14
+Create Date: 2026-10-18 11:02:41.512903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6968867e68db'
+down_revision = '3b7c2d9a5f14'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, extra create_index kwargs)
+INDEXES = [
+    ('ix_comment_course_id_created_at', 'comment', ['course_id', 'created_at', 'id'], {}),
+    ('ix_comment_user_id_created_at', 'comment', ['user_id', 'created_at', 'id'], {}),
+    ('ix_favorites_user_id_timestamp', 'favorites', ['user_id', 'timestamp', 'id'], {}),
+    ('ix_favorites_course_id', 'favorites', ['course_id'], {}),
+    ('ix_favorites_target_user_id', 'favorites', ['target_user_id'], {}),
+    ('ix_page_view_viewed_user_id_timestamp', 'page_view', ['viewed_user_id', 'timestamp', 'id'], {}),
+    ('ix_page_view_viewer_user_id', 'page_view', ['viewer_user_id'], {}),
+    ('ix_course_tutor_id_timestamp', 'course', ['tutor_id', 'timestamp', 'id'], {}),
+    ('ix_course_academy_id_timestamp', 'course', ['academy_id', 'timestamp', 'id'], {}),
+    ('ix_course_rating', 'course', ['rating', 'id'], {}),
+    ('ix_course_city_id', 'course', ['city_id'], {}),
+    ('ix_course_district_id', 'course', ['district_id'], {}),
+    ('ix_course_latitude_longitude', 'course', ['latitude', 'longitude'], {}),
+    ('ix_user_city_id', 'user', ['city_id'], {}),
+    ('ix_user_latitude_longitude', 'user', ['latitude', 'longitude'], {}),
+    ('ix_user_role_rating', 'user', ['role', 'rating', 'id'], {}),
+    ('ix_user_teacher_rating', 'user', ['rating', 'id'],
+     {'postgresql_where': sa.text("role IN ('TUTOR', 'ACADEMY')")}),
+    ('ix_course_title_trgm', 'course', ['title'],
+     {'postgresql_using': 'gin', 'postgresql_ops': {'title': 'gin_trgm_ops'}}),
+    ('ix_course_description_trgm', 'course', ['description'],
+     {'postgresql_using': 'gin', 'postgresql_ops': {'description': 'gin_trgm_ops'}}),
+    ('ix_user_name_trgm', 'user', ['name'],
+     {'postgresql_using': 'gin', 'postgresql_ops': {'name': 'gin_trgm_ops'}}),
+    ('ix_user_surname_trgm', 'user', ['surname'],
+     {'postgresql_using': 'gin', 'postgresql_ops': {'surname': 'gin_trgm_ops'}}),
+    ('ix_user_degree_trgm', 'user', ['degree'],
+     {'postgresql_using': 'gin', 'postgresql_ops': {'degree': 'gin_trgm_ops'}}),
+]
+
+# (table, constraint) added NOT VALID by 3b7c2d9a5f14
+FOREIGN_KEYS = [
+    ('user', 'user_city_id_fkey'),
+    ('course', 'course_city_id_fkey'),
+    ('course', 'course_district_id_fkey'),
+]
+
+
+def _is_invalid(name):
+    """True if a previous concurrent build of the index failed and left it INVALID."""
+    if op.get_context().as_sql:
+        return False
+    return op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+        "WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"
+    ), {"name": name}).first() is not None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in INDEXES:
+            # IF NOT EXISTS would silently keep an INVALID leftover
+            if _is_invalid(name):
+                op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_concurrently=True, **kwargs)
+        # Scans the table under SHARE UPDATE EXCLUSIVE, writes are not blocked
+        for table, constraint in FOREIGN_KEYS:
+            op.execute(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT {constraint}')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -29,6 +29,26 @@ class User(db.Model):
     degree = db.Column(db.String(150), nullable=True)
     location = db.Column(db.String(50),nullable=True)
     role = db.Column(Enum(Role,name="role"), nullable=False, default=Role.STUDENT)
+    # Normalized `location` and optional coordinates (see LocationService)
+    city_id = db.Column(db.Integer, db.ForeignKey('city.id'), nullable=True, index=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+
+    # Composite indexes follow the (filter, sort, id) of each query; Postgres
+    # scans them backwards for the DESC keyset order (migration 6968867e68db)
+    __table_args__ = (
+        # Bounding-box prefilter of "near me" queries
+        db.Index('ix_user_latitude_longitude', 'latitude', 'longitude'),
+        # top-users with a role filter / over tutors and academies
+        db.Index('ix_user_role_rating', 'role', 'rating', 'id'),
+        db.Index('ix_user_teacher_rating', 'rating', 'id',
+                 postgresql_where=db.text("role IN ('TUTOR', 'ACADEMY')")),
+        # ILIKE '%...%' filters
+        db.Index('ix_user_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_user_surname_trgm', 'surname', postgresql_using='gin',
+                 postgresql_ops={'surname': 'gin_trgm_ops'}),
+        db.Index('ix_user_degree_trgm', 'degree', postgresql_using='gin', postgresql_ops={'degree': 'gin_trgm_ops'}),
+    )
 
     # Relationships
     comments = db.relationship('Comment', back_populates='user', lazy='dynamic')
@@ -50,6 +70,9 @@ class User(db.Model):
         lazy='dynamic',
         foreign_keys='Favorites.target_user_id'  # 🔑 explicitly specify target_user_id
     )
+
+    stats = db.relationship('UserRatingStats', back_populates='user', uselist=False,
+                            cascade='all, delete-orphan', passive_deletes=True)
     
     def __init__(self, name, surname, role=Role.STUDENT, phone=None, profile_picture=None, 
                  bio=None, degree=None, location=None, rating=0):
@@ -67,7 +90,7 @@ class User(db.Model):
     def get_course_rating_stats(self):
         """
         Aggregate rating stats from all courses for this user
-        as a tutor or academy.
+        as a tutor or academy, read from the user_rating_stats row.
         Returns:
         {
             "average_rating": float,
@@ -75,42 +98,13 @@ class User(db.Model):
             "ratings": { "5": int, "4": int, "3": int, "2": int, "1": int }
         }
         """
-        # Collect all course IDs for this user
-        course_ids = [c.id for c in self.courses_as_tutor.all()] + [c.id for c in self.courses_as_academy.all()]
-        if not course_ids:
+        if self.stats is None:
             return {
                 "average_rating": 0.0,
                 "count": 0,
                 "ratings": {str(i): 0 for i in range(1, 6)}
             }
-
-        # Aggregate ratings from comments
-        rating_query = (
-            db.session.query(
-                Comment.rating,
-                func.count(Comment.rating).label("count")
-            )
-            .filter(Comment.course_id.in_(course_ids))
-            .group_by(Comment.rating)
-            .all()
-        )
-
-        rating_counts = {str(i): 0 for i in range(1, 6)}
-        total_count = 0
-        total_sum = 0
-
-        for r, c in rating_query:
-            rating_counts[str(int(r))] = c
-            total_count += c
-            total_sum += r * c
-
-        average_rating = round(total_sum / total_count, 2) if total_count > 0 else 0.0
-
-        return {
-            "average_rating": average_rating,
-            "count": total_count,
-            "ratings": rating_counts
-        }
+        return self.stats.to_dict()
 
     def to_dict(self):
         return {
@@ -170,17 +164,90 @@ class Course(db.Model):
     online = db.Column(db.Boolean, default=False)  # Online/offline course indicator
     picture = db.Column(db.String(255), nullable=True)  # URL or file path to the course picture
     timestamp = db.Column(db.DateTime, default=func.now())  # Timestamp for the view
+    # Normalized city/district and optional coordinates (see LocationService)
+    city_id = db.Column(db.Integer, db.ForeignKey('city.id'), nullable=True, index=True)
+    district_id = db.Column(db.Integer, db.ForeignKey('district.id'), nullable=True, index=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        # Bounding-box prefilter of "near me" queries
+        db.Index('ix_course_latitude_longitude', 'latitude', 'longitude'),
+        # my-courses (newest first) and owner lookups
+        db.Index('ix_course_tutor_id_timestamp', 'tutor_id', 'timestamp', 'id'),
+        db.Index('ix_course_academy_id_timestamp', 'academy_id', 'timestamp', 'id'),
+        # top-courses
+        db.Index('ix_course_rating', 'rating', 'id'),
+        # ILIKE '%...%' search fallback
+        db.Index('ix_course_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+        db.Index('ix_course_description_trgm', 'description', postgresql_using='gin',
+                 postgresql_ops={'description': 'gin_trgm_ops'}),
+    )
     # Relationships
     comments = db.relationship('Comment', back_populates='course', lazy='dynamic')
     tutor = db.relationship('User', back_populates='courses_as_tutor', foreign_keys=[tutor_id])
     academy = db.relationship('User', back_populates='courses_as_academy', foreign_keys=[academy_id])
 
     favorites = db.relationship('Favorites', back_populates='course', lazy='dynamic')
+    stats = db.relationship('CourseRatingStats', back_populates='course', uselist=False,
+                            cascade='all, delete-orphan', passive_deletes=True)
     
     
+    @staticmethod
+    def _build_rating_stats(rating_rows):
+        """
+        Builds the rating stats dict from (rating, count) rows.
+        """
+        rating_counts = {str(i): 0 for i in range(1, 6)}
+        total_count = 0
+        total_sum = 0
+
+        for r, c in rating_rows:
+            rating_counts[str(int(r))] = c
+            total_count += c
+            total_sum += r * c
+
+        average_rating = round(total_sum / total_count, 2) if total_count > 0 else 0.0
+
+        return {
+            "average_rating": average_rating,
+            "count": total_count,
+            "ratings": rating_counts
+        }
+
+    @staticmethod
+    def get_rating_stats_for_courses(course_ids):
+        """
+        Loads rating stats for many courses with a single query on
+        course_rating_stats. Returns { course_id: stats } with the same
+        stats shape as get_rating_stats(); courses without comments get
+        empty stats.
+        """
+        course_ids = list(set(course_ids))
+        if not course_ids:
+            return {}
+
+        stats_rows = CourseRatingStats.query.filter(CourseRatingStats.course_id.in_(course_ids)).all()
+        stats_by_course = {row.course_id: row.to_dict() for row in stats_rows}
+
+        return {
+            course_id: stats_by_course.get(course_id) or Course._build_rating_stats([])
+            for course_id in course_ids
+        }
+
+    def get_rating_stats(self):
+        """
+        Returns rating stats from the materialized course_rating_stats row
+        (see get_rating_stats_from_comments() for the shape).
+        """
+        if self.stats is None:
+            return Course._build_rating_stats([])
+        return self.stats.to_dict()
+
     def get_rating_stats_from_comments(self):
         """
-        Returns ratings stats based on the Comment table:
+        Recomputes ratings stats from the Comment table (full scan of the
+        course's comments, use get_rating_stats() on read paths):
         {
             "average_rating": float,
             "count": int,
@@ -199,29 +266,14 @@ class Course(db.Model):
                 Comment.rating,
                 func.count(Comment.rating).label("count")
             )
-            .filter(Comment.course_id == self.id)
+            .filter(Comment.course_id == self.id, Comment.rating.isnot(None))
             .group_by(Comment.rating)
             .all()
         )
 
-        # Initialize counts
-        rating_counts = {str(i): 0 for i in range(1, 6)}
-        total_count = 0
-        total_sum = 0
-
-        for r, c in rating_query:
-            rating_counts[str(int(r))] = c
-            total_count += c
-            total_sum += r * c
-
-        average_rating = round(total_sum / total_count, 2) if total_count > 0 else 0.0
+        return Course._build_rating_stats(rating_query)
 
-        return {
-            "average_rating": average_rating,
-            "count": total_count,
-            "ratings": rating_counts
-        }
-    def to_dict(self, user_flag=True, include_rating_stats=True):
+    def to_dict(self, user_flag=True, include_rating_stats=True, rating_stats=None):
         course_dict = {
             "id": self.id,
             "title": self.title,
@@ -231,6 +283,8 @@ class Course(db.Model):
             "academy": self.academy_id,
             "city": self.city,
             "district": self.district,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
             "start_time": self.start_time.isoformat() if self.start_time else None,
             "end_time": self.end_time.isoformat() if self.end_time else None,
             "price": self.price,
@@ -245,15 +299,113 @@ class Course(db.Model):
                 course_dict["tutor"] = self.tutor.course_to_dict()
 
         if include_rating_stats:
-            course_dict["rating_stats"] = self.get_rating_stats_from_comments()
+            # Pass rating_stats (from get_rating_stats_for_courses) when serializing lists
+            if rating_stats is None:
+                rating_stats = self.get_rating_stats()
+            course_dict["rating_stats"] = rating_stats
 
         return course_dict
     
     
      
         
+class City(db.Model):
+    """City dimension: `normalized_name` is the lowercased, whitespace-collapsed name."""
+    __tablename__ = 'city'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    normalized_name = db.Column(db.String(100), nullable=False, unique=True)
+    latitude = db.Column(db.Float, nullable=True)  # centroid, optional (not set by the app)
+    longitude = db.Column(db.Float, nullable=True)
+
+
+class District(db.Model):
+    """District dimension, unique per city."""
+    __tablename__ = 'district'
+    __table_args__ = (
+        db.UniqueConstraint('city_id', 'normalized_name', name='uq_district_city_id_normalized_name'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    city_id = db.Column(db.Integer, db.ForeignKey('city.id', ondelete='CASCADE'), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    normalized_name = db.Column(db.String(100), nullable=False, index=True)
+    latitude = db.Column(db.Float, nullable=True)  # centroid, optional (not set by the app)
+    longitude = db.Column(db.Float, nullable=True)
+
+
+class CourseRatingStats(db.Model):
+    """
+    Materialized rating histogram of a course, maintained by delta on
+    every comment write (see RatingService).
+    """
+    __tablename__ = 'course_rating_stats'
+
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id', ondelete='CASCADE'), primary_key=True)
+    count_1 = db.Column(db.Integer, nullable=False, default=0)
+    count_2 = db.Column(db.Integer, nullable=False, default=0)
+    count_3 = db.Column(db.Integer, nullable=False, default=0)
+    count_4 = db.Column(db.Integer, nullable=False, default=0)
+    count_5 = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+
+    course = db.relationship('Course', back_populates='stats')
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0.0
+
+    def to_dict(self):
+        return {
+            "average_rating": round(self.average_rating, 2),
+            "count": self.rating_count,
+            "ratings": {str(i): getattr(self, f"count_{i}") for i in range(1, 6)}
+        }
+
+
+class UserRatingStats(db.Model):
+    """
+    Rating rollup of a tutor/academy over all of their courses, maintained
+    by delta whenever a course's stats or rating change (see RatingService).
+    The histogram counts comments; course_rating_sum/course_count back
+    User.rating, which is the average of the courses' ratings.
+    """
+    __tablename__ = 'user_rating_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    count_1 = db.Column(db.Integer, nullable=False, default=0)
+    count_2 = db.Column(db.Integer, nullable=False, default=0)
+    count_3 = db.Column(db.Integer, nullable=False, default=0)
+    count_4 = db.Column(db.Integer, nullable=False, default=0)
+    count_5 = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    course_rating_sum = db.Column(db.Float, nullable=False, default=0)
+    course_count = db.Column(db.Integer, nullable=False, default=0)
+
+    user = db.relationship('User', back_populates='stats')
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else 0.0
+
+    def to_dict(self):
+        return {
+            "average_rating": round(self.average_rating, 2),
+            "count": self.rating_count,
+            "ratings": {str(i): getattr(self, f"count_{i}") for i in range(1, 6)}
+        }
+
+
 class Comment(db.Model):
     __tablename__ = 'comment'
+    __table_args__ = (
+        # Comments of a course / of a user, newest first
+        db.Index('ix_comment_course_id_created_at', 'course_id', 'created_at', 'id'),
+        db.Index('ix_comment_user_id_created_at', 'user_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=True)
@@ -279,6 +431,11 @@ class Comment(db.Model):
 
 class PageView(db.Model):
     __tablename__ = 'page_view'
+    __table_args__ = (
+        # Views of a user, newest first (optionally within a time range)
+        db.Index('ix_page_view_viewed_user_id_timestamp', 'viewed_user_id', 'timestamp', 'id'),
+        db.Index('ix_page_view_viewer_user_id', 'viewer_user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     viewed_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # User whose page is being viewed
@@ -289,8 +446,78 @@ class PageView(db.Model):
     viewed_user = db.relationship('User', foreign_keys=[viewed_user_id], back_populates='views_received')
     viewer_user = db.relationship('User', foreign_keys=[viewer_user_id], back_populates='views_made')
 
+class PageViewRollup(db.Model):
+    """
+    Page views of a user pre-aggregated per hour and per day bucket,
+    maintained by the page view ingestion path.
+    """
+    __tablename__ = 'page_view_rollup'
+
+    viewed_user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    granularity = db.Column(db.String(4), primary_key=True)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    view_count = db.Column(db.Integer, nullable=False, default=0)
+    unique_viewers = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            "bucket_start": self.bucket_start.isoformat(),
+            "count": self.view_count,
+            "unique_viewers": self.unique_viewers,
+        }
+
+
+class PageViewBucketViewer(db.Model):
+    """Viewers already counted in a recent rollup bucket (keeps unique_viewers exact; old rows are pruned)."""
+    __tablename__ = 'page_view_bucket_viewer'
+
+    viewed_user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    granularity = db.Column(db.String(4), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    viewer_user_id = db.Column(db.Integer, primary_key=True)
+
+
+class PageViewSketch(db.Model):
+    """
+    HyperLogLog sketch (utils/hll.py) of the distinct viewers of a user on
+    one day. Sketches merge across any date range for unique visitor counts.
+    """
+    __tablename__ = 'page_view_sketch'
+
+    viewed_user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    registers = db.Column(BYTEA, nullable=False)
+
+
+class SearchOutbox(db.Model):
+    """
+    Pending Elasticsearch change of a user/course document, written in the
+    same transaction as the entity change and drained by the search outbox
+    dispatcher. The document itself is built from the row at dispatch time.
+    """
+    __tablename__ = 'search_outbox'
+    __table_args__ = (
+        db.Index('ix_search_outbox_next_attempt_at', 'next_attempt_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)  # also the external ES version
+    index_name = db.Column(db.String(32), nullable=False)  # 'users' or 'courses' alias
+    document_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(8), nullable=False, default='index')  # 'index' or 'delete'
+    created_at = db.Column(db.DateTime, default=func.now())
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=func.now())
+    last_error = db.Column(db.Text, nullable=True)
+
+
 class Favorites(db.Model):
     __tablename__ = 'favorites'
+    __table_args__ = (
+        # Favorites of a user, newest first
+        db.Index('ix_favorites_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_favorites_course_id', 'course_id'),
+        db.Index('ix_favorites_target_user_id', 'target_user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # who favorites
@@ -0,0 +1,78 @@
+"""
+Import-time budget of the web app: imports wsgi (app factory + every
+blueprint) in a fresh interpreter with `-X importtime` and exits with
+status 1 when it takes longer than the budget, or when it pulls in a
+module that must only load on first use (Elasticsearch client, alembic,
+...). Keeps worker spawn and test startup fast.
+
+    python scripts/check_import_time.py [--budget-ms 1200] [--runs 3] [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded lazily: by the first search / bulk request, or by the `flask db` CLI only
+LAZY_MODULES = ["elasticsearch", "elastic_transport", "alembic", "flask_migrate", "requests"]
+
+PROBE = (
+    "import sys, wsgi; "
+    "print(','.join(m for m in {lazy!r} if m in sys.modules))"
+)
+
+
+def _import_profile():
+    """(cumulative µs of `import wsgi`, {module: self µs}, lazy modules loaded) of one fresh interpreter."""
+    env = dict(os.environ)
+    # Never connects at import time; sqlite keeps the probe independent of a running Postgres
+    env.setdefault("DATABASE_URL", "sqlite://")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(lazy=LAZY_MODULES)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import wsgi failed:\n{result.stderr[-2000:]}")
+
+    total, self_times = 0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header
+        self_times[name.strip()] = int(self_us)
+        if name.strip() == "wsgi":
+            total = int(cumulative_us)
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return total, self_times, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", 1200)))
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters; the fastest run is kept")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules (self time) to print")
+    args = parser.parse_args()
+
+    profiles = [_import_profile() for _ in range(max(args.runs, 1))]
+    total, self_times, loaded = min(profiles, key=lambda profile: profile[0])
+    total_ms = total / 1000
+
+    print(f"import wsgi: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms, best of {len(profiles)})")
+    for name, self_us in sorted(self_times.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {self_us / 1000:7.1f} ms  {name}")
+
+    failed = False
+    if total_ms > args.budget_ms:
+        print(f"Over budget by {total_ms - args.budget_ms:.0f} ms")
+        failed = True
+    if loaded:
+        print(f"Imported at startup, should load on first use: {', '.join(loaded)}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
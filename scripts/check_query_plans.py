@@ -0,0 +1,145 @@
+"""
+Runs the read paths of the services against the configured database,
+EXPLAINs every SELECT they issue and exits with status 1 when a plan
+still contains a sequential scan.
+
+    DATABASE_URL=postgresql://... python scripts/check_query_plans.py [--allow TABLE ...] [--verbose]
+
+The plans are taken with enable_seqscan = off, so a Seq Scan left in a
+plan means no index can serve the query, whatever the table sizes (a
+tiny dev database would otherwise seq scan everything). Ids are taken
+from the database: it needs at least one tutor with a course.
+Run it against Postgres after `flask db upgrade`.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from wsgi import app  # noqa: E402
+from extensions import db  # noqa: E402
+from models.user import User, Course  # noqa: E402
+from services.course_service import CourseService  # noqa: E402
+from services.user_service import UserService  # noqa: E402
+from services.favorites_service import FavoritesService  # noqa: E402
+from services.pageview_service import PageViewService  # noqa: E402
+from services.search_service import SearchService  # noqa: E402
+
+# (name, call(tutor, course, city)) for every read path worth checking
+SCENARIOS = [
+    ("top courses", lambda t, c, city: CourseService.get_top_courses(user_id=t.id, min_rating=1)),
+    ("top courses by city/district", lambda t, c, city: CourseService.get_top_courses(
+        city=c.city, district=c.district, cursor="")),
+    ("top courses of tutors", lambda t, c, city: CourseService.get_top_courses(role="tutor", cursor="")),
+    ("top courses near", lambda t, c, city: CourseService.get_top_courses(near=(55.75, 37.62, 10), cursor="")),
+    ("top users", lambda t, c, city: UserService.get_top_users(user_id=t.id)),
+    ("top users by role", lambda t, c, city: UserService.get_top_users(role="tutor", cursor="")),
+    ("top users by location/degree", lambda t, c, city: UserService.get_top_users(
+        location=city, degree="math", cursor="")),
+    ("my courses", lambda t, c, city: CourseService(t.id, "tutor").get_my_courses(1, 10)),
+    ("my courses, keyset", lambda t, c, city: CourseService(t.id, "tutor").get_my_courses(1, 10, cursor="")),
+    ("course comments", lambda t, c, city: CourseService(t.id, "tutor").get_comments_by_course(c.id, 1, 10)),
+    ("course comments, keyset", lambda t, c, city: CourseService(t.id, "tutor").get_comments_by_course(
+        c.id, 1, 10, cursor="")),
+    ("comments of my courses", lambda t, c, city: CourseService(t.id, "tutor").get_all_comments_by_user_role(
+        cursor="")),
+    ("comments of a student", lambda t, c, city: CourseService(t.id, "student").get_all_comments_by_user_role(
+        cursor="")),
+    ("course", lambda t, c, city: CourseService.get_course_by_id(c.id).to_dict()),
+    ("profile", lambda t, c, city: UserService.get_user_by_id(t.id).to_dict_profile()),
+    ("favorites", lambda t, c, city: FavoritesService.get_favorites_for_user(t.id, cursor="")),
+    ("favorite ids", lambda t, c, city: FavoritesService.get_favorite_ids(t.id)),
+    ("page views", lambda t, c, city: PageViewService.get_views_for_user(t.id)),
+    ("page views, keyset", lambda t, c, city: PageViewService.get_views_for_user(t.id, cursor="")),
+    ("views timeseries", lambda t, c, city: PageViewService.get_views_timeseries(t.id, "day")),
+    ("unique viewers", lambda t, c, city: PageViewService.get_unique_viewers(t.id)),
+    ("user search fallback", lambda t, c, city: SearchService._search_users_db(
+        "anna", 1, 10, "desc", None, 0)),
+    ("course search fallback", lambda t, c, city: SearchService._search_courses_db(
+        "python", 1, 10, None, "desc", None, None, None, None, None)),
+]
+
+
+def _seq_scans(plan):
+    """Relation names of the Seq Scan nodes of an EXPLAIN (FORMAT JSON) plan tree."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def capture_statements(tutor, course, city):
+    """Runs every scenario and returns {statement: (parameters, scenario name)} of the SELECTs issued."""
+    statements = {}
+    current = {"name": None}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")) and statement not in statements:
+            statements[statement] = (parameters, current["name"])
+
+    # Reads of @read_only methods may run on a replica engine
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", capture)
+    try:
+        for name, call in SCENARIOS:
+            current["name"] = name
+            try:
+                call(tutor, course, city)
+            except Exception as e:
+                print(f"[error] {name}: {e}")
+            finally:
+                db.session.rollback()
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", capture)
+    return statements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--allow", action="append", default=[], metavar="TABLE",
+                        help="table allowed to be sequentially scanned (repeatable)")
+    parser.add_argument("--verbose", action="store_true", help="print every statement and its plan")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            sys.exit("check_query_plans needs a PostgreSQL DATABASE_URL")
+        course = Course.query.filter(Course.tutor_id.isnot(None)).first()
+        if course is None:
+            sys.exit("No course with a tutor in the database, nothing to check")
+        tutor = User.query.get(course.tutor_id)
+        city = course.city or "moscow"
+        db.session.rollback()
+
+        statements = capture_statements(tutor, course, city)
+
+        failures = 0
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql("SET enable_seqscan = off")
+            for statement, (parameters, name) in statements.items():
+                plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scans = [table for table in _seq_scans(plan[0]["Plan"]) if table not in args.allow]
+                if scans:
+                    failures += 1
+                    print(f"[seq scan] {name}: {', '.join(sorted(set(scans)))}\n  {' '.join(statement.split())}")
+                elif args.verbose:
+                    print(f"[ok] {name}\n  {' '.join(statement.split())}")
+                if args.verbose:
+                    print(json.dumps(plan[0]["Plan"], indent=2))
+            connection.rollback()
+
+    print(f"{len(statements)} statements checked, {failures} with sequential scans.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,12 @@
-import requests
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token
 from models.user import User, Role
-from extensions import db,es
-import jwt
+from extensions import db
 from werkzeug.exceptions import BadRequest
 from datetime import datetime, timedelta
 import base64
 from _logger import log
+from services.search_outbox_service import SearchOutboxService
 class AuthService:
     def __init__(self, db_session=db.session):
         self.db = db_session
@@ -33,13 +32,10 @@ class AuthService:
         )
         
         self.db.add(user)
+        self.db.flush()
+        # Indexed in Elasticsearch by the search outbox once committed
+        SearchOutboxService.enqueue_users([user.id])
         self.db.commit()
-        #Save to elasticsearch
-        resp = es.index(index="users", id=user.id, document={
-            "user_id": user.id,
-            "name": user.name,
-            "surname": user.surname
-        })
         additional_claims = {"role": user.role.value}
         token = create_access_token(identity=str(user.id), additional_claims=additional_claims,expires_delta = timedelta(days=180))
         res = {"access_token":'Bearer ' + token, "user": user.to_dict_profile()}
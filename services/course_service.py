@@ -1,7 +1,7 @@
 from flask_jwt_extended import get_jwt_identity
 from werkzeug.exceptions import BadRequest
-from models.user import User, Role,Course, Comment, Favorites
-from extensions import db, es
+from models.user import User, Role,Course, Comment
+from extensions import db
 from datetime import datetime
 from sqlalchemy.orm import scoped_session
 from flask import abort
@@ -12,6 +12,15 @@ from flask import current_app
 import uuid
 import os
 from _logger import log
+from services.rating_service import RatingService
+from services.search_outbox_service import SearchOutboxService
+from utils.pagination import keyset_paginate
+from utils.counting import paginate
+from utils.cache import response_cache, course_key, profile_key
+from services.favorites_service import FavoritesService
+from services.location_service import LocationService
+from utils.geo import within_radius, parse_coordinates
+from utils.db_routing import read_only
 
 class CourseService:
     
@@ -21,7 +30,8 @@ class CourseService:
 
     def validate_course_data(self, data):
         # Check if necessary fields are present
-        required_fields = ["title", "description", "price", "city", "district", "start_time", "end_time","online","picture"]
+        required_fields = ["title", "description", "price", "city", "district", "start_time", "end_time","online","picture",
+                           "latitude", "longitude"]
         for field in data:
             if field not in required_fields:
                 raise BadRequest(f"'{field}' is required")
@@ -31,6 +41,20 @@ class CourseService:
             if data['start_time'] >= data['end_time']:
                 raise BadRequest("Start time must be before end time")
 
+    @staticmethod
+    def _apply_location(course, data):
+        """Links the course to the city/district dimensions and sets its coordinates."""
+        for field in ('city', 'district'):
+            if data.get(field) is not None and not isinstance(data[field], str):
+                raise BadRequest(f"{field} must be a string")
+        if 'city' in data or 'district' in data or course.city_id is None:
+            course.city_id, course.district_id = LocationService.resolve(course.city, course.district)
+        if 'latitude' in data or 'longitude' in data:
+            try:
+                course.latitude, course.longitude = parse_coordinates(data.get('latitude'), data.get('longitude'))
+            except ValueError as e:
+                raise BadRequest(str(e))
+
     def create_course(self, data):
         # Validate course data
         print('validate')
@@ -55,16 +79,16 @@ class CourseService:
             academy_id=self.user_id if self.role == 'academy' else None  # Set academy_id if the role is 'academy'
         )
         
+        CourseService._apply_location(course, data)
+
         db.session.add(course)
+        db.session.flush()
+        RatingService.register_course(course)
+        # Indexed in Elasticsearch by the search outbox once committed
+        SearchOutboxService.enqueue_courses([course.id])
         db.session.commit()
-        course_data = {
-            'title': course.title,
-            'description': course.description,
-        }
-        try:
-            es.index(index="courses", id=course.id, body=course_data)
-        except Exception as e:
-            raise ValueError("Error in indexinng course")
+        # The owner's profile carries the course rollup
+        response_cache.invalidate(profile_key(self.user_id))
         return course
 
     def save_course_picture(self,base64_str):
@@ -99,14 +123,10 @@ class CourseService:
         or (self.role == "academy" and int(course.academy_id) != int(self.user_id)):
             raise BadRequest("You are not authorized to modify this course.")
         # Update course fields if provided in the data
-        course_updated = False  # Flag to check if the course is modified
-
         if 'title' in data:
             course.title = data['title']
-            course_updated = True
         if 'description' in data:
             course.description = data['description']
-            course_updated = True
         if 'price' in data:
             course.price = data['price']
         if 'city' in data:
@@ -121,38 +141,27 @@ class CourseService:
             course.online = data['online']
         if 'picture' in data:
             course.picture = self.save_course_picture(data['picture'])
+        CourseService._apply_location(course, data)
+
+        # Every field is searchable/filterable, so the whole document is re-indexed
+        SearchOutboxService.enqueue_courses([course.id])
 
         # Commit changes to the database
         db.session.commit()
-
-        # If course title or description was updated, also update it in Elasticsearch
-        if course_updated:
-            course_data = {
-            'title': course.title,
-            'description': course.description,
-            }
-            es.update(index="courses", id=course.id, body={"doc": course_data})   
+        response_cache.invalidate(course_key(course.id))
         return course
     
-    def get_all_comments_by_user_role(self, page=1, per_page=10):
+    @read_only
+    def get_all_comments_by_user_role(self, page=1, per_page=10, cursor=None, with_total=False):
         """
         Fetch all comments based on the user's role with pagination:
         - If the user is a student, return comments they wrote.
         - If the user is a tutor or academy, return comments for their courses.
+        Passing a cursor (empty string for the first page) switches to keyset pagination.
         """
         if self.role == Role.STUDENT.value:
-            # Return paginated comments written by the student
-            comments = Comment.query.filter_by(user_id=self.user_id).order_by(Comment.created_at.desc()).paginate(
-                page=page, per_page=per_page, error_out=False
-            )
-            comments_list = [comment.to_dict() for comment in comments]
-            return {
-                "total": comments.total,  # Total number of courses
-                "page": comments.page,  # Current page
-                "per_page": comments.per_page,  # Courses per page
-                "total_pages": comments.pages,  # Total number of pages
-                "comments": comments_list,  # List of courses for the current page
-            }
+            # Comments written by the student
+            query = Comment.query.filter_by(user_id=self.user_id)
 
         elif self.role in [Role.TUTOR.value, Role.ACADEMY.value]:
             # Fetch courses created by the tutor or academy
@@ -162,54 +171,95 @@ class CourseService:
             if not courses:
                 return []
 
-            # Fetch comments for these courses and paginate
+            # Comments for these courses
             course_ids = [course.id for course in courses]
-            comments = Comment.query.filter(Comment.course_id.in_(course_ids)).order_by(Comment.created_at.desc()).paginate(
-                page=page, per_page=per_page, error_out=False
-            )
-            comments_list = [comment.to_dict() for comment in comments]
-            return {
-                "total": comments.total,  # Total number of courses
-                "page": comments.page,  # Current page
-                "per_page": comments.per_page,  # Courses per page
-                "total_pages": comments.pages,  # Total number of pages
-                "comments": comments_list,  # List of courses for the current page
-            }
+            query = Comment.query.filter(Comment.course_id.in_(course_ids))
 
         else:
             raise ValueError("Invalid role")
+
+        count_filters = {"role": self.role, "user_id": str(self.user_id)}
+        if cursor is not None:
+            page_data = keyset_paginate(query, Comment.created_at, Comment.id, cursor=cursor,
+                                        per_page=per_page, with_total=with_total,
+                                        endpoint="my_comments", filters=count_filters)
+            page_data["comments"] = [comment.to_dict() for comment in page_data.pop("items")]
+            return page_data
+
+        comments = paginate(query.order_by(Comment.created_at.desc()), page, per_page,
+                            endpoint="my_comments", filters=count_filters)
+        comments_list = [comment.to_dict() for comment in comments]
+        return {
+            "total": comments.total,  # Total number of courses
+            "total_exact": comments.total_exact,
+            "page": comments.page,  # Current page
+            "per_page": comments.per_page,  # Courses per page
+            "total_pages": comments.pages,  # Total number of pages
+            "comments": comments_list,  # List of courses for the current page
+        }
     
     
-    def get_comments_by_course(self,course_id, page, per_page):
-        """Fetch paginated comments for a course."""
+    @read_only
+    def get_comments_by_course(self,course_id, page, per_page, cursor=None, with_total=False):
+        """Fetch paginated comments for a course (keyset pagination when a cursor is passed)."""
         # Check if course exists
         course = Course.query.get(course_id)
         if not course:
             abort(404, description="Comment for this course not found")
+
+        query = Comment.query.filter_by(course_id=course_id)
+        count_filters = {"course_id": int(course_id)}
+        if cursor is not None:
+            page_data = keyset_paginate(query, Comment.created_at, Comment.id, cursor=cursor,
+                                        per_page=per_page, with_total=with_total,
+                                        endpoint="course_comments", filters=count_filters)
+            page_data["comments"] = [comment.to_dict() for comment in page_data.pop("items")]
+            return page_data
         
-        paginated_comments = Comment.query.filter_by(course_id=course_id).order_by(Comment.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        paginated_comments = paginate(query.order_by(Comment.created_at.desc()), page, per_page,
+                                      endpoint="course_comments", filters=count_filters)
         comments_list = [course.to_dict() for course in paginated_comments]
         # If no comments found
         return {
             "total": paginated_comments.total,  # Total number of courses
+            "total_exact": paginated_comments.total_exact,
             "page": paginated_comments.page,  # Current page
             "per_page": paginated_comments.per_page,  # Courses per page
             "total_pages": paginated_comments.pages,  # Total number of pages
             "comments": comments_list,  # List of courses for the current page
         }
         
-    def get_my_courses(self, page, per_page):
+    def get_my_courses(self, page, per_page, cursor=None, with_total=False):
         if self.role == 'tutor':
-            query = Course.query.filter_by(tutor_id=self.user_id).order_by(Course.timestamp.desc())
+            query = Course.query.filter_by(tutor_id=self.user_id)
         elif self.role == 'academy':
-            query = Course.query.filter_by(academy_id=self.user_id).order_by(Course.timestamp.desc())
+            query = Course.query.filter_by(academy_id=self.user_id)
         else:
             raise BadRequest("User role not authorized.")
 
-        paginated_courses = query.paginate(page=page, per_page=per_page, error_out=False)
-        courses_list = [course.to_dict(user_flag=False) for course in paginated_courses ]
+        count_filters = {"role": self.role, "user_id": str(self.user_id)}
+        if cursor is not None:
+            page_data = keyset_paginate(query, Course.timestamp, Course.id, cursor=cursor,
+                                        per_page=per_page, with_total=with_total,
+                                        endpoint="my_courses", filters=count_filters)
+            courses = page_data.pop("items")
+            rating_stats = Course.get_rating_stats_for_courses([course.id for course in courses])
+            page_data["courses"] = [
+                course.to_dict(user_flag=False, rating_stats=rating_stats[course.id])
+                for course in courses
+            ]
+            return page_data
+
+        paginated_courses = paginate(query.order_by(Course.timestamp.desc()), page, per_page,
+                                     endpoint="my_courses", filters=count_filters)
+        rating_stats = Course.get_rating_stats_for_courses([course.id for course in paginated_courses.items])
+        courses_list = [
+            course.to_dict(user_flag=False, rating_stats=rating_stats[course.id])
+            for course in paginated_courses.items
+        ]
         return {
             "total": paginated_courses.total,  # Total number of courses
+            "total_exact": paginated_courses.total_exact,
             "page": paginated_courses.page,  # Current page
             "per_page": paginated_courses.per_page,  # Courses per page
             "total_pages": paginated_courses.pages,  # Total number of pages
@@ -225,6 +275,9 @@ class CourseService:
             
             # Step 2: Check if the user is authorized to delete the course
             if self.role == 'tutor' and int(course.tutor_id) == int(self.user_id):
+                # Take the course out of the tutor's rating rollup
+                RatingService.unregister_course(course)
+
                 # Delete all comments related to the course
                 db.session.query(Comment).filter(Comment.course_id == course.id).delete(synchronize_session=False)
     
@@ -232,6 +285,7 @@ class CourseService:
                 db.session.delete(course)
     
             elif self.role == 'academy' and int(course.academy_id) == int(self.user_id):
+                RatingService.unregister_course(course)
                 db.session.query(Comment).filter(Comment.course_id == course.id).delete(synchronize_session=False)
     
                 # Step 3: Delete the course
@@ -240,10 +294,12 @@ class CourseService:
             else:
                 raise BadRequest("You are not authorized to delete this course.")
             
+            SearchOutboxService.enqueue_courses([course_id], operation='delete')
+
             # Step 4: Commit in a controlled way (flush, then commit)
             # Ensure no other changes are pending before committing
             db.session.commit()
-            es.delete(index="courses", id=course_id)
+            response_cache.invalidate(course_key(course_id), profile_key(self.user_id))
             
             return {"msg": "Course and associated comments deleted successfully."}
     
@@ -261,28 +317,23 @@ class CourseService:
     
     @staticmethod
     def get_course(course_id):
-        course = CourseService.get_course_by_id(course_id)
-        return course.to_dict()
+        # Cached payload, invalidated by course, owner and comment writes.
+        # Loaded from the primary: a lagging replica would cache a stale course for CACHE_TTL
+        return response_cache.get_or_set(
+            course_key(course_id),
+            lambda: CourseService.get_course_by_id(course_id).to_dict()
+        )
     
     @staticmethod
     def _attach_favorites(user_id, courses):
         """
         Добавляет к каждому курсу поле is_favorite для текущего пользователя.
-        Выполняет один SQL-запрос для всех курсов.
+        Проверка по кэшированному множеству избранного, без запроса к БД.
         """
         if not user_id or not courses:
-            return [course.to_dict(is_favorite=False) for course in courses]
+            return [{**c, "is_favorite": False} for c in courses]
 
-        # Собираем все course_ids
-        course_ids = [c['id'] for c in courses]
-
-        # Получаем избранные одним запросом
-        favorite_ids = {
-            f.course_id for f in Favorites.query.filter(
-                Favorites.user_id == user_id,
-                Favorites.course_id.in_(course_ids)
-            ).all()
-        }
+        favorite_ids = FavoritesService.get_favorite_ids(user_id).course_ids
 
         # Формируем итоговый список
         return [
@@ -291,7 +342,14 @@ class CourseService:
         ]
     
     @staticmethod
-    def get_top_courses(user_id = None, role=None, city=None, district=None, min_rating=0, online=None, page=1, per_page=10):
+    @read_only
+    def get_top_courses(user_id = None, role=None, city=None, district=None, min_rating=0, online=None, page=1, per_page=10,
+                        cursor=None, with_total=False, near=None):
+        """
+        Курсы по рейтингу. city/district сравниваются по нормализованному
+        названию (через city_id/district_id), near=(lat, lon, radius_km)
+        оставляет курсы в радиусе.
+        """
         query = Course.query.options(
             joinedload(Course.tutor), joinedload(Course.academy)
         )
@@ -304,22 +362,44 @@ class CourseService:
             # показать только курсы, где академия указана
             query = query.filter(Course.academy_id.isnot(None))
         if city:
-            query = query.filter(Course.city.ilike(f"%{city}%"))
+            query = query.filter(LocationService.city_filter(Course.city_id, city))
         if district:
-            query = query.filter(Course.district.ilike(f"%{district}%"))
+            query = query.filter(LocationService.district_filter(Course.district_id, district, city))
         if online is not None:
             query = query.filter(Course.online == online)
         if min_rating:
             query = query.filter(Course.rating >= min_rating)
+        if near:
+            query = query.filter(within_radius(Course.latitude, Course.longitude, *near))
+
+        count_filters = {"role": role, "city": city, "district": district, "online": online, "min_rating": min_rating,
+                         "near": near}
+        if cursor is not None:
+            # Keyset pagination on (rating, id), no total count unless asked
+            page_data = keyset_paginate(query, Course.rating, Course.id, cursor=cursor,
+                                        per_page=per_page, with_total=with_total,
+                                        endpoint="top_courses", filters=count_filters)
+            items = page_data.pop("items")
+            rating_stats = Course.get_rating_stats_for_courses([course.id for course in items])
+            _courses = [
+                course.to_dict(user_flag=True, rating_stats=rating_stats[course.id])
+                for course in items
+            ]
+            page_data["courses"] = CourseService._attach_favorites(user_id=user_id, courses=_courses)
+            return page_data
 
         # Sort by rating
         query = query.order_by(desc(Course.rating))
 
         # Paginate
-        paginated = query.paginate(page=page, per_page=per_page, error_out=False)
+        paginated = paginate(query, page, per_page, endpoint="top_courses", filters=count_filters)
 
-        # Serialize
-        _courses = [course.to_dict(user_flag=True) for course in paginated.items]
+        # Serialize (rating stats for the whole page in one query)
+        rating_stats = Course.get_rating_stats_for_courses([course.id for course in paginated.items])
+        _courses = [
+            course.to_dict(user_flag=True, rating_stats=rating_stats[course.id])
+            for course in paginated.items
+        ]
         courses = (CourseService._attach_favorites(user_id=user_id,courses=_courses))
 
          
@@ -327,6 +407,7 @@ class CourseService:
         return {
             "courses": courses,
             "total": paginated.total,
+            "total_exact": paginated.total_exact,
             "page": paginated.page,
             "pages": paginated.pages,
             "per_page": paginated.per_page,
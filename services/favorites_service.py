@@ -1,8 +1,74 @@
+import json
 from models.user import User
-from models.user import Favorites
+from models.user import Favorites, Course
 from extensions import db
+from flask import current_app
+from collections import namedtuple
+from sqlalchemy.orm import joinedload
+from utils.pagination import keyset_paginate
+from utils.cache import LocalCache, response_cache
+from utils.db_routing import use_primary
+from utils.metrics import register_metrics
+
+# Ids a user has in favorites, for O(1) is_favorite checks on list pages
+FavoriteIds = namedtuple('FavoriteIds', ['course_ids', 'user_ids'])
+
+# Local level (FAVORITES_CACHE_TTL, a few seconds) in front of the shared
+# backend of response_cache (CACHE_SHARED_URL), which add/delete_favorite
+# invalidate for every worker
+favorite_ids_cache = LocalCache(max_entries=10000)
+register_metrics("favorite_ids_cache", lambda: {**favorite_ids_cache.counters, "entries": len(favorite_ids_cache)})
+
 
 class FavoritesService:
+    @staticmethod
+    def get_favorite_ids(user_id):
+        """
+        Course ids and target user ids in the user's favorites, as frozensets.
+        Loaded from the primary (a lagging replica could miss the user's last
+        change) with one query on the two id columns. Cached per user for
+        FAVORITES_CACHE_TTL seconds in the worker and CACHE_TTL seconds in
+        the shared backend; add/delete_favorite invalidate both.
+        """
+        user_id = int(user_id)
+        favorite_ids = favorite_ids_cache.get(user_id)
+        if favorite_ids is not None:
+            return favorite_ids
+
+        config = current_app.config
+        raw = response_cache.get_shared(FavoritesService._shared_key(user_id))
+        if raw is not None:
+            course_ids, user_ids = json.loads(raw)
+            favorite_ids = FavoriteIds(course_ids=frozenset(course_ids), user_ids=frozenset(user_ids))
+        else:
+            with use_primary():
+                rows = db.session.query(Favorites.course_id, Favorites.target_user_id)\
+                    .filter(Favorites.user_id == user_id).all()
+            favorite_ids = FavoritesService.favorite_ids_from_rows(rows)
+            response_cache.set_shared(FavoritesService._shared_key(user_id),
+                                      json.dumps([sorted(favorite_ids.course_ids), sorted(favorite_ids.user_ids)]),
+                                      config.get('CACHE_TTL', 300))
+        favorite_ids_cache.set(user_id, favorite_ids, config.get('FAVORITES_CACHE_TTL', 5))
+        return favorite_ids
+
+    @staticmethod
+    def _shared_key(user_id):
+        return f"favorite_ids:{int(user_id)}"
+
+    @staticmethod
+    def invalidate_favorite_ids(user_id):
+        """Drops the cached favorite ids of a user (this worker and the shared backend). Call after the commit."""
+        favorite_ids_cache.delete(int(user_id))
+        response_cache.invalidate(FavoritesService._shared_key(user_id))
+
+    @staticmethod
+    def favorite_ids_from_rows(rows):
+        """FavoriteIds of (course_id, target_user_id) rows."""
+        return FavoriteIds(
+            course_ids=frozenset(course_id for course_id, _ in rows if course_id is not None),
+            user_ids=frozenset(target_user_id for _, target_user_id in rows if target_user_id is not None),
+        )
+
     @staticmethod
     def add_favorite(user_id, course_id=None, target_user_id=None):
         if not course_id and not target_user_id:
@@ -26,15 +92,32 @@ class FavoritesService:
         try:
             db.session.add(favorite)
             db.session.commit()
+            FavoritesService.invalidate_favorite_ids(user_id)
             return {'msg': 'Added to favorites'}, 201
         except Exception as e:
             db.session.rollback()
             return {'msg': f'Error adding favorite: {str(e)}'}, 500
 
     @staticmethod
-    def get_favorites_for_user(user_id):
-        favorites = Favorites.query.filter_by(user_id=user_id)\
-            .order_by(Favorites.timestamp.desc()).all()
+    def get_favorites_for_user(user_id, cursor=None, per_page=50, with_total=False):
+        """
+        One page of the user's favorites, newest first, keyset-paginated on
+        (timestamp, id): pass the returned next_cursor to get the next page.
+        Courses (with tutor, academy and rating stats) and target users are
+        joined into the page query, so a page costs one query whatever its size.
+        """
+        query = Favorites.query.filter(Favorites.user_id == user_id).options(
+            joinedload(Favorites.course).joinedload(Course.tutor),
+            joinedload(Favorites.course).joinedload(Course.academy),
+            joinedload(Favorites.course).joinedload(Course.stats),
+            joinedload(Favorites.target_user),
+        )
+        try:
+            page_data = keyset_paginate(query, Favorites.timestamp, Favorites.id, cursor=cursor,
+                                        per_page=per_page, with_total=with_total,
+                                        endpoint="favorites", filters={"user_id": str(user_id)})
+        except ValueError as e:
+            return {'msg': str(e)}, 400
 
         favorite_data = {
             'courses': [],
@@ -42,7 +125,7 @@ class FavoritesService:
             'academies': []
         }
 
-        for fav in favorites:
+        for fav in page_data.pop("items"):
             base_data = {
                 'id': fav.id,
                 'timestamp': fav.timestamp
@@ -60,7 +143,7 @@ class FavoritesService:
                     favorite_data['tutors'].append(base_data)
                 elif role == 'academy':
                     favorite_data['academies'].append(base_data)
-        return {'favorites': favorite_data}, 200
+        return {'favorites': favorite_data, **page_data}, 200
 
     @staticmethod
     def delete_favorite(user_id, course_id=None, target_user_id=None):
@@ -76,6 +159,7 @@ class FavoritesService:
         try:
             db.session.delete(favorite)
             db.session.commit()
+            FavoritesService.invalidate_favorite_ids(user_id)
             return {'msg': 'Favorite removed successfully'}, 200
         except Exception as e:
             db.session.rollback()
@@ -83,11 +167,10 @@ class FavoritesService:
 
     @staticmethod
     def is_favorite(user_id, course_id=None, target_user_id=None):
-        query = Favorites.query.filter_by(user_id=user_id)
-    
+        favorite_ids = FavoritesService.get_favorite_ids(user_id)
+
         if course_id:
-            query = query.filter_by(course_id=course_id)
+            return int(course_id) in favorite_ids.course_ids
         if target_user_id:
-            query = query.filter_by(target_user_id=target_user_id)
-    
-        return db.session.query(query.exists()).scalar()
\ No newline at end of file
+            return int(target_user_id) in favorite_ids.user_ids
+        return bool(favorite_ids.course_ids or favorite_ids.user_ids)
\ No newline at end of file
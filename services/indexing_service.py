@@ -0,0 +1,358 @@
+from sqlalchemy.orm import joinedload
+from collections import deque
+from models.user import User, Role, Course, SearchOutbox
+from sqlalchemy import func, text
+import json
+import os
+import time
+from extensions import es, db
+from _logger import log
+
+# Aliases the application reads and writes; each points to a versioned index
+USERS_INDEX = "users"
+COURSES_INDEX = "courses"
+
+ANALYSIS_SETTINGS = {
+    "analysis": {
+        "tokenizer": {
+            "edge_ngram_tokenizer": {
+                "type": "edge_ngram", "min_gram": 2, "max_gram": 20,
+                "token_chars": ["letter", "digit"],
+            },
+            "trigram_tokenizer": {
+                "type": "ngram", "min_gram": 3, "max_gram": 3,
+                "token_chars": ["letter", "digit"],
+            },
+        },
+        "analyzer": {
+            # Prefix matching: "pyt" finds "python"
+            "prefix": {"type": "custom", "tokenizer": "edge_ngram_tokenizer", "filter": ["lowercase", "asciifolding"]},
+            "prefix_search": {"type": "custom", "tokenizer": "standard", "filter": ["lowercase", "asciifolding"]},
+            # Substring matching: "thon" finds "python"
+            "trigram": {"type": "custom", "tokenizer": "trigram_tokenizer", "filter": ["lowercase", "asciifolding"]},
+        },
+        "char_filter": {
+            "collapse_whitespace": {"type": "pattern_replace", "pattern": "\\s+", "replacement": " "},
+        },
+        "normalizer": {
+            # Same key as location_service.normalize_name: trimmed, whitespace-collapsed, lowercase
+            "location_key": {"type": "custom", "char_filter": ["collapse_whitespace"], "filter": ["lowercase", "trim"]},
+        },
+    }
+}
+
+
+def _searchable_text(keyword=True):
+    """Text field with prefix/trigram subfields (and a keyword one for exact filters)."""
+    fields = {
+        "prefix": {"type": "text", "analyzer": "prefix", "search_analyzer": "prefix_search"},
+        "ngram": {"type": "text", "analyzer": "trigram"},
+    }
+    if keyword:
+        fields["keyword"] = {"type": "keyword", "ignore_above": 256}
+    return {"type": "text", "fields": fields}
+
+
+def _location_text():
+    """City/district/location field; filters use the normalized subfield."""
+    return {"type": "text", "fields": {
+        "keyword": {"type": "keyword", "ignore_above": 256},
+        "normalized": {"type": "keyword", "normalizer": "location_key", "ignore_above": 256},
+    }}
+
+
+_USER_SUMMARY = {
+    "properties": {
+        "id": {"type": "integer"},
+        "name": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+        "surname": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+        "role": {"type": "keyword"},
+        "rating": {"type": "float"},
+        "profile_picture": {"type": "keyword", "index": False},
+    }
+}
+
+# Bump "version" whenever settings/mappings change, then run
+# `flask search-index migrate <alias>` to build the new index behind the alias.
+INDEX_DEFINITIONS = {
+    USERS_INDEX: {
+        "version": 5,
+        "settings": ANALYSIS_SETTINGS,
+        "mappings": {
+            "dynamic": False,
+            "properties": {
+                "user_id": {"type": "integer"},
+                "name": _searchable_text(),
+                "surname": _searchable_text(),
+                "role": {"type": "keyword"},
+                "location": _location_text(),
+                "rating": {"type": "float"},
+                "geo": {"type": "geo_point"},
+                # Search-as-you-type (tutors and academies only)
+                "suggest": {"type": "completion"},
+            },
+        },
+    },
+    COURSES_INDEX: {
+        "version": 4,
+        "settings": ANALYSIS_SETTINGS,
+        "mappings": {
+            "dynamic": False,
+            "properties": {
+                "id": {"type": "integer"},
+                "title": _searchable_text(),
+                "description": _searchable_text(keyword=False),
+                "city": _location_text(),
+                "district": _location_text(),
+                "price": {"type": "float"},
+                "rating": {"type": "float"},
+                "online": {"type": "boolean"},
+                "start_time": {"type": "date"},
+                "end_time": {"type": "date"},
+                "picture": {"type": "keyword", "index": False},
+                "tutor_id": {"type": "integer"},
+                "academy_id": {"type": "integer"},
+                "geo": {"type": "geo_point"},
+                "tutor": _USER_SUMMARY,
+                "academy": _USER_SUMMARY,
+                # Returned from _source only
+                "rating_stats": {"type": "object", "enabled": False},
+                # Search-as-you-type on the title
+                "suggest": {"type": "completion"},
+            },
+        },
+    },
+}
+
+
+def versioned_index_name(alias, version):
+    return f"{alias}_v{version}"
+
+
+class IndexingService:
+
+    @staticmethod
+    def _suggest_weight(rating):
+        # Higher rated tutors/academies/courses come first among equal prefixes
+        return int(round((rating or 0) * 10)) + 1
+
+    @staticmethod
+    def _geo_point(entity):
+        if entity.latitude is None or entity.longitude is None:
+            return None
+        return {"lat": entity.latitude, "lon": entity.longitude}
+
+    @staticmethod
+    def user_document(user):
+        """Elasticsearch document of a user (the whole document, never a partial one)."""
+        document = {
+            "user_id": user.id,
+            "name": user.name,
+            "surname": user.surname,
+            "role": user.role.value,
+            "location": user.location,
+            "rating": float(user.rating or 0),
+            "geo": IndexingService._geo_point(user),
+        }
+        if user.role in (Role.TUTOR, Role.ACADEMY):
+            full_name = " ".join(part for part in (user.name, user.surname) if part)
+            document["suggest"] = {
+                "input": [part for part in (full_name, user.surname) if part],
+                "weight": IndexingService._suggest_weight(user.rating),
+            }
+        return document
+
+    @staticmethod
+    def course_document(course, rating_stats=None):
+        """
+        Elasticsearch document of a course: the Course.to_dict() payload
+        (tutor/academy summary and rating stats included), so search
+        responses are built from _source, plus the owner ids for filters.
+        Numeric fields are always floats so dynamic mapping doesn't pick long.
+        """
+        document = course.to_dict(user_flag=True, rating_stats=rating_stats)
+        document["tutor_id"] = course.tutor_id
+        document["academy_id"] = course.academy_id
+        document["price"] = float(course.price or 0)
+        document["rating"] = float(course.rating or 0)
+        document["geo"] = IndexingService._geo_point(course)
+        document["suggest"] = {
+            "input": [course.title],
+            "weight": IndexingService._suggest_weight(course.rating),
+        }
+        return document
+
+    @staticmethod
+    def _create_index(alias):
+        definition = INDEX_DEFINITIONS[alias]
+        name = versioned_index_name(alias, definition["version"])
+        es.indices.create(index=name, settings=definition["settings"], mappings=definition["mappings"])
+        return name
+
+    @staticmethod
+    def ensure_indices():
+        """
+        Creates the current version of every index behind its alias when
+        the alias doesn't exist yet. A legacy concrete index with the alias
+        name (dynamic mapping) is left alone: migrate it with migrate_index().
+        """
+        for alias in INDEX_DEFINITIONS:
+            if es.indices.exists_alias(name=alias):
+                continue
+            if es.indices.exists(index=alias):
+                log(f"Index '{alias}' is not an alias, run `flask search-index migrate {alias}`")
+                continue
+            name = IndexingService._create_index(alias)
+            es.indices.put_alias(index=name, name=alias)
+            log(f"Created index {name} behind alias '{alias}'")
+
+    @staticmethod
+    def migrate_index(alias):
+        """
+        Builds the current version of `alias` and moves the alias to it:
+        creates the versioned index, fills it from Postgres with reindex()
+        (external versions, like the outbox), then swaps the alias
+        atomically. A legacy concrete index named like the alias is deleted
+        just before the alias is added. Returns the new index name and the
+        number of indexed documents.
+        """
+        definition = INDEX_DEFINITIONS[alias]
+        name = versioned_index_name(alias, definition["version"])
+        if es.indices.exists(index=name):
+            raise ValueError(f"Index {name} already exists, bump the version in INDEX_DEFINITIONS")
+
+        is_alias = bool(es.indices.exists_alias(name=alias))
+        legacy = not is_alias and bool(es.indices.exists(index=alias))
+        old_indices = list(es.indices.get_alias(name=alias)) if is_alias else []
+
+        IndexingService._create_index(alias)
+        # Not copied with _reindex: the old index may hold internal versions
+        # that don't compare with the outbox ids
+        result = IndexingService.reindex(alias, index=name)
+        es.indices.refresh(index=name)
+        copied = result["indexed"]
+
+        if legacy:
+            es.indices.delete(index=alias)
+        actions = [{"remove": {"index": index, "alias": alias}} for index in old_indices]
+        actions.append({"add": {"index": name, "alias": alias}})
+        es.indices.update_aliases(actions=actions)
+        return name, copied
+
+    @staticmethod
+    def _read_checkpoint(path):
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_checkpoint(path, checkpoint):
+        # Write then rename, so an interrupted run never leaves a torn file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _reindex_source(alias, after_id, chunk_size):
+        """Rows of `alias` with id > after_id, in id order, streamed from a server-side cursor."""
+        if alias == USERS_INDEX:
+            query = User.query.filter(User.id > after_id).order_by(User.id)
+            return query.yield_per(chunk_size), IndexingService.user_document
+        query = Course.query.options(
+            joinedload(Course.tutor), joinedload(Course.academy), joinedload(Course.stats)
+        ).filter(Course.id > after_id).order_by(Course.id)
+        return query.yield_per(chunk_size), IndexingService.course_document
+
+    @staticmethod
+    def _external_version():
+        """
+        ES external version of documents built from the current rows: a
+        fresh search_outbox id, above every change already queued and below
+        every later one (the outbox sends its row id as the version).
+        """
+        if db.session.get_bind().dialect.name == "postgresql":
+            return db.session.execute(text("SELECT nextval(pg_get_serial_sequence('search_outbox', 'id'))")).scalar()
+        return (db.session.query(func.max(SearchOutbox.id)).scalar() or 0) + 1
+
+    @staticmethod
+    def reindex(alias, chunk_size=500, threads=1, checkpoint_path=None, resume=False, progress=None, index=None):
+        """
+        Rebuilds the documents of `alias` (users or courses) from Postgres,
+        into `index` (default: the alias). Rows are streamed with yield_per
+        and sent through the bulk helpers, streaming_bulk with threads=1,
+        parallel_bulk otherwise. Documents carry an external version from
+        the outbox sequence (see _external_version), so a change queued
+        during the run still wins and an older one is rejected (409,
+        counted as skipped). After every chunk the highest id below which
+        every document is acknowledged is saved to checkpoint_path;
+        resume=True starts after it. `progress` is called with (indexed,
+        failed, docs/sec) once per chunk.
+        Returns {"indexed", "skipped", "failed", "seconds", "docs_per_sec", "last_id"}.
+        """
+        from elasticsearch import helpers
+
+        version = IndexingService._external_version()
+        checkpoint = IndexingService._read_checkpoint(checkpoint_path)
+        last_id = checkpoint.get(alias, 0) if resume else 0
+        rows, to_document = IndexingService._reindex_source(alias, last_id, chunk_size)
+
+        # Ids sent but not acknowledged yet, in id order (parallel_bulk may complete out of order)
+        pending = deque()
+        done = set()
+
+        def actions():
+            for row in rows:
+                pending.append(row.id)
+                yield {"_index": index or alias, "_id": row.id, "_source": to_document(row),
+                       "version": version, "version_type": "external"}
+
+        if threads > 1:
+            results = helpers.parallel_bulk(es, actions(), thread_count=threads, chunk_size=chunk_size,
+                                            raise_on_error=False, raise_on_exception=False)
+        else:
+            results = helpers.streaming_bulk(es, actions(), chunk_size=chunk_size, max_retries=3,
+                                             raise_on_error=False, raise_on_exception=False)
+
+        indexed = skipped = failed = 0
+        started = time.monotonic()
+        for ok, item in results:
+            result = item.get("index", {})
+            if ok:
+                indexed += 1
+            elif result.get("status") == 409:
+                # The outbox already indexed a newer change
+                skipped += 1
+            else:
+                failed += 1
+                if failed <= 10:
+                    log(f"Failed to index {alias}/{result.get('_id')}: {result.get('error')}")
+            # Failed documents still advance the checkpoint; they are logged above
+            done.add(int(result["_id"]))
+
+            if (indexed + skipped + failed) % chunk_size == 0:
+                while pending and pending[0] in done:
+                    last_id = pending.popleft()
+                    done.discard(last_id)
+                if checkpoint_path:
+                    checkpoint[alias] = last_id
+                    IndexingService._write_checkpoint(checkpoint_path, checkpoint)
+                if progress:
+                    progress(indexed, failed, (indexed + skipped + failed) / max(time.monotonic() - started, 1e-6))
+
+        while pending and pending[0] in done:
+            last_id = pending.popleft()
+        if checkpoint_path:
+            checkpoint[alias] = last_id
+            IndexingService._write_checkpoint(checkpoint_path, checkpoint)
+
+        seconds = time.monotonic() - started
+        return {
+            "indexed": indexed,
+            "skipped": skipped,
+            "failed": failed,
+            "seconds": round(seconds, 2),
+            "docs_per_sec": round((indexed + skipped + failed) / seconds, 1) if seconds else 0.0,
+            "last_id": last_id,
+        }
@@ -0,0 +1,119 @@
+from sqlalchemy import select, update, union, func, false
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models.user import User, Course, City, District
+from extensions import db
+
+
+def _normalized_sql(column):
+    """SQL counterpart of normalize_name()."""
+    return func.lower(func.regexp_replace(func.trim(column), r'\s+', ' ', 'g'))
+
+
+def normalize_name(name):
+    """Lowercased, whitespace-collapsed name used as the dimension key."""
+    if not name:
+        return None
+    return " ".join(str(name).split()).lower() or None
+
+
+class LocationService:
+
+    @staticmethod
+    def get_or_create_city(name):
+        """Id of the city named `name` (created if new), None for an empty name. Runs in the caller's transaction."""
+        key = normalize_name(name)
+        if key is None:
+            return None
+        db.session.execute(
+            pg_insert(City).values(name=" ".join(str(name).split()), normalized_name=key)
+            .on_conflict_do_nothing(index_elements=[City.normalized_name])
+        )
+        return db.session.query(City.id).filter(City.normalized_name == key).scalar()
+
+    @staticmethod
+    def get_or_create_district(city_id, name):
+        key = normalize_name(name)
+        if key is None or city_id is None:
+            return None
+        db.session.execute(
+            pg_insert(District).values(city_id=city_id, name=" ".join(str(name).split()), normalized_name=key)
+            .on_conflict_do_nothing(index_elements=[District.city_id, District.normalized_name])
+        )
+        return db.session.query(District.id).filter(
+            District.city_id == city_id, District.normalized_name == key
+        ).scalar()
+
+    @staticmethod
+    def resolve(city, district=None):
+        """(city_id, district_id) for the given names, creating missing dimension rows."""
+        city_id = LocationService.get_or_create_city(city)
+        return city_id, LocationService.get_or_create_district(city_id, district)
+
+    @staticmethod
+    def city_filter(column, city):
+        """Equality filter of an integer city_id column by city name (no result for unknown names)."""
+        city_id = db.session.query(City.id).filter(City.normalized_name == normalize_name(city)).scalar()
+        return column == city_id if city_id is not None else false()
+
+    @staticmethod
+    def district_filter(column, district, city=None):
+        """Filter of a district_id column by district name, within `city` when given."""
+        district_ids = select(District.id).where(District.normalized_name == normalize_name(district))
+        if city:
+            district_ids = district_ids.join(City, City.id == District.city_id)\
+                .where(City.normalized_name == normalize_name(city))
+        return column.in_(district_ids)
+
+    @staticmethod
+    def backfill():
+        """
+        Creates the city/district rows for every course city/district and
+        user location and links the rows to them. Coordinates are not
+        derived: rows without them stay out of "near me" filters.
+        Returns (cities, districts).
+        """
+        try:
+            names = db.session.execute(union(
+                select(Course.city).where(Course.city.isnot(None)),
+                select(User.location).where(User.location.isnot(None)),
+            )).scalars().all()
+            city_ids = {}
+            for name in names:
+                key = normalize_name(name)
+                if key and key not in city_ids:
+                    city_ids[key] = LocationService.get_or_create_city(name)
+
+            pairs = db.session.query(Course.city, Course.district).distinct()\
+                .filter(Course.district.isnot(None)).all()
+            district_ids = {}
+            for city, district in pairs:
+                key = (normalize_name(city), normalize_name(district))
+                if key[0] in city_ids and key[1] and key not in district_ids:
+                    district_ids[key] = LocationService.get_or_create_district(city_ids[key[0]], district)
+
+            # Link rows through the normalized names, one UPDATE per table
+            db.session.execute(
+                update(Course).values(city_id=select(City.id).where(
+                    City.normalized_name == _normalized_sql(Course.city)
+                ).scalar_subquery())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                update(Course).values(district_id=select(District.id).where(
+                    District.city_id == Course.city_id,
+                    District.normalized_name == _normalized_sql(Course.district)
+                ).scalar_subquery())
+                .execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                update(User).values(city_id=select(City.id).where(
+                    City.normalized_name == _normalized_sql(User.location)
+                ).scalar_subquery())
+                .execution_options(synchronize_session=False)
+            )
+
+            db.session.commit()
+            return len(city_ids), len(district_ids)
+        except Exception:
+            db.session.rollback()
+            raise
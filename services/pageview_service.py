@@ -1,42 +1,530 @@
 from models.user import User
-from models.user import PageView
+from models.user import PageView, PageViewRollup, PageViewBucketViewer, PageViewSketch
 from extensions import db
+from utils.pagination import keyset_paginate
+from utils.counting import count_total
+from utils.metrics import register_metrics
+from flask import current_app
+from sqlalchemy import insert, select, func, distinct, literal, tuple_, update, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from datetime import datetime, timedelta
+from utils.hll import HyperLogLog
+from _logger import log
+import logging
+import threading
+import atexit
+import queue
+import time
+import os
+
+# SQLSTATEs of a transaction that may succeed when run again
+RETRYABLE_SQLSTATES = ('40P01', '40001')  # deadlock_detected, serialization_failure
+WRITE_ATTEMPTS = 3
+
+
+def _is_retryable(error):
+    orig = getattr(error, 'orig', None)
+    # psycopg exposes .sqlstate, psycopg2 .pgcode
+    return (getattr(orig, 'sqlstate', None) or getattr(orig, 'pgcode', None)) in RETRYABLE_SQLSTATES
+
+
+class PageViewBuffer:
+    """
+    Bounded in-process buffer of page views, written by a background
+    worker with one multi-row INSERT per batch. A batch is flushed every
+    PAGE_VIEW_BATCH_SIZE events or PAGE_VIEW_FLUSH_INTERVAL_MS milliseconds,
+    whichever comes first. A batch that hits a deadlock or serialization
+    failure (workers flush concurrently) is retried a few times; when it
+    fails a foreign key (a user deleted since the request), the views of
+    missing users are dropped and the rest is written. When the
+    buffer is full new events are dropped (and counted) instead of blocking
+    the request. drain() flushes what is left and runs at interpreter exit.
+    The worker also prunes old exact-viewer rows every
+    PAGE_VIEW_VIEWER_PRUNE_INTERVAL seconds (see prune_bucket_viewers).
+    """
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval_ms=500):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._app = None
+        self._next_prune = 0.0
+        self._counters = {
+            "enqueued": 0,
+            "dropped": 0,
+            "flushed": 0,
+            "failed": 0,
+            "retries": 0,
+            "invalid": 0,
+            "batches": 0,
+            "max_depth": 0,
+            "last_flush_ms": 0.0,
+        }
+        atexit.register(self.drain)
+
+    def _ensure_started(self):
+        # Started lazily, and again in a forked worker (threads don't survive fork)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            app = current_app._get_current_object()
+            self.max_size = app.config.get("PAGE_VIEW_BUFFER_SIZE", self.max_size)
+            self.batch_size = app.config.get("PAGE_VIEW_BATCH_SIZE", self.batch_size)
+            self.flush_interval_ms = app.config.get("PAGE_VIEW_FLUSH_INTERVAL_MS", self.flush_interval_ms)
+            self._app = app
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self.max_size)
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="page-view-buffer", daemon=True)
+            self._thread.start()
+
+    def push(self, viewed_user_id, viewer_user_id):
+        """Queues a page view; returns False if it was dropped because the buffer is full."""
+        self._ensure_started()
+        event = {
+            "viewed_user_id": int(viewed_user_id),
+            "viewer_user_id": int(viewer_user_id),
+            "timestamp": datetime.utcnow(),
+        }
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self._counters["dropped"] += 1
+            return False
+        with self._lock:
+            self._counters["enqueued"] += 1
+            self._counters["max_depth"] = max(self._counters["max_depth"], self._queue.qsize())
+        return True
+
+    def _take_batch(self):
+        """Blocks until batch_size events are buffered or the flush interval elapses."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval_ms / 1000.0
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            if time.monotonic() >= self._next_prune:
+                self._prune()
+
+    def _prune(self):
+        config = self._app.config
+        self._next_prune = time.monotonic() + config.get("PAGE_VIEW_VIEWER_PRUNE_INTERVAL", 3600)
+        with self._app.app_context():
+            try:
+                PageViewService.prune_bucket_viewers(config.get("PAGE_VIEW_VIEWER_RETENTION_DAYS", 2))
+            except Exception:
+                logging.getLogger(__name__).exception("Failed to prune page_view_bucket_viewer")
+            finally:
+                db.session.remove()
+
+    def _insert(self, batch):
+        """Inserts the batch and updates rollups/sketches in one transaction, retried on deadlocks."""
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                db.session.execute(insert(PageView), batch)
+                new_daily_viewers = PageViewService.apply_rollups(batch)
+                PageViewService.apply_sketches(new_daily_viewers)
+                db.session.commit()
+                return
+            except DBAPIError as e:
+                db.session.rollback()
+                if attempt == WRITE_ATTEMPTS or not _is_retryable(e):
+                    raise
+                with self._lock:
+                    self._counters["retries"] += 1
+                time.sleep(0.05 * attempt)
+
+    @staticmethod
+    def _without_missing_users(batch):
+        """Events of the batch whose viewed and viewer users both still exist."""
+        user_ids = {event["viewed_user_id"] for event in batch} | {event["viewer_user_id"] for event in batch}
+        existing = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+        return [event for event in batch
+                if event["viewed_user_id"] in existing and event["viewer_user_id"] in existing]
+
+    def _write(self, batch):
+        started = time.monotonic()
+        total, flushed, invalid = len(batch), 0, 0
+        with self._app.app_context():
+            try:
+                try:
+                    self._insert(batch)
+                except IntegrityError:
+                    db.session.rollback()
+                    valid = self._without_missing_users(batch)
+                    invalid = len(batch) - len(valid)
+                    if valid:
+                        self._insert(valid)
+                    flushed = len(valid)
+                else:
+                    flushed = total
+            except Exception:
+                db.session.rollback()
+                logging.getLogger(__name__).exception("Failed to write %s page views", len(batch))
+            finally:
+                db.session.remove()
+        with self._lock:
+            self._counters["flushed"] += flushed
+            self._counters["failed"] += total - flushed - invalid
+            self._counters["invalid"] += invalid
+            self._counters["batches"] += 1
+            self._counters["last_flush_ms"] = round((time.monotonic() - started) * 1000, 2)
+
+    def drain(self, timeout=10):
+        """Stops the worker and writes every buffered event (deploy/shutdown hook)."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(remaining), self.batch_size):
+            self._write(remaining[start:start + self.batch_size])
+        self._thread = None
+        if remaining:
+            log(f"Drained {len(remaining)} buffered page views")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["depth"] = self._queue.qsize() if self._queue is not None else 0
+        stats["capacity"] = self.max_size
+        return stats
+
+
+ROLLUP_GRANULARITIES = ('hour', 'day')
+
+# pg_try_advisory_xact_lock key of prune_bucket_viewers
+PRUNE_LOCK_ID = 7008
+
+
+def bucket_start(timestamp, granularity):
+    """Start of the hour/day bucket containing timestamp."""
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError("granularity must be 'hour' or 'day'")
+
+
+page_view_buffer = PageViewBuffer()
+register_metrics("page_view_buffer", page_view_buffer.stats)
 
 class PageViewService:
     @staticmethod
-    def add_page_view(viewed_user_id, viewer_user_id):
+    def record_page_view(viewed_user_id, viewer_user_id):
+        """
+        Records a page view off the request path: the event goes to the
+        in-process buffer and is inserted in a batch by its worker.
+        """
+        page_view_buffer.push(viewed_user_id, viewer_user_id)
+
+    @staticmethod
+    def apply_rollups(events):
+        """
+        Adds a batch of page view events (dicts with viewed_user_id,
+        viewer_user_id, timestamp) to the hour/day rollups. Viewers new to a
+        bucket are found with one INSERT .. ON CONFLICT DO NOTHING RETURNING
+        on page_view_bucket_viewer; then every touched bucket is upserted
+        once. Rows are written in key order, so concurrent batches lock them
+        in the same order. Runs in the caller's transaction.
+        Returns the (viewed_user_id, day, viewer_user_id) viewers that are
+        new for their day bucket.
+        """
+        view_counts = {}
+        viewers = set()
+        for event in events:
+            for granularity in ROLLUP_GRANULARITIES:
+                key = (event['viewed_user_id'], granularity, bucket_start(event['timestamp'], granularity))
+                view_counts[key] = view_counts.get(key, 0) + 1
+                viewers.add(key + (event['viewer_user_id'],))
+        if not view_counts:
+            return []
+
+        new_viewers = db.session.execute(
+            pg_insert(PageViewBucketViewer)
+            .values([
+                {'viewed_user_id': viewed, 'granularity': granularity, 'bucket_start': start, 'viewer_user_id': viewer}
+                for viewed, granularity, start, viewer in sorted(viewers)
+            ])
+            .on_conflict_do_nothing()
+            .returning(PageViewBucketViewer.viewed_user_id, PageViewBucketViewer.granularity,
+                       PageViewBucketViewer.bucket_start, PageViewBucketViewer.viewer_user_id)
+        ).all()
+        unique_counts = {}
+        new_daily_viewers = []
+        for viewed, granularity, start, viewer in new_viewers:
+            key = (viewed, granularity, start)
+            unique_counts[key] = unique_counts.get(key, 0) + 1
+            if granularity == 'day':
+                new_daily_viewers.append((viewed, start.date(), viewer))
+
+        stmt = pg_insert(PageViewRollup).values([
+            {
+                'viewed_user_id': viewed, 'granularity': granularity, 'bucket_start': start,
+                'view_count': count, 'unique_viewers': unique_counts.get((viewed, granularity, start), 0),
+            }
+            for (viewed, granularity, start), count in sorted(view_counts.items())
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['viewed_user_id', 'granularity', 'bucket_start'],
+            set_={
+                'view_count': PageViewRollup.view_count + stmt.excluded.view_count,
+                'unique_viewers': PageViewRollup.unique_viewers + stmt.excluded.unique_viewers,
+            }
+        )
+        db.session.execute(stmt)
+        return new_daily_viewers
+
+    @staticmethod
+    def apply_sketches(daily_viewers):
+        """
+        Adds (viewed_user_id, day, viewer_user_id) viewers to the per-day
+        HyperLogLog sketches. Missing sketches are created empty first, then
+        all touched rows are locked, merged in Python and written back, so
+        concurrent workers never overwrite each other. Rows are inserted and
+        locked in (viewed_user_id, day) order, the same in every worker.
+        Runs in the caller's transaction.
+        """
+        viewers_by_key = {}
+        for viewed, day, viewer in daily_viewers:
+            viewers_by_key.setdefault((viewed, day), []).append(viewer)
+        if not viewers_by_key:
+            return
+
+        db.session.execute(
+            pg_insert(PageViewSketch)
+            .values([
+                {'viewed_user_id': viewed, 'day': day, 'registers': HyperLogLog().to_bytes()}
+                for viewed, day in sorted(viewers_by_key)
+            ])
+            .on_conflict_do_nothing()
+        )
+        rows = db.session.execute(
+            select(PageViewSketch.viewed_user_id, PageViewSketch.day, PageViewSketch.registers)
+            .where(tuple_(PageViewSketch.viewed_user_id, PageViewSketch.day).in_(sorted(viewers_by_key)))
+            .order_by(PageViewSketch.viewed_user_id, PageViewSketch.day)
+            .with_for_update()
+        ).all()
+
+        updates = []
+        for viewed, day, registers in rows:
+            sketch = HyperLogLog.from_bytes(registers)
+            for viewer in viewers_by_key[(viewed, day)]:
+                sketch.add(viewer)
+            updates.append({'b_viewed': viewed, 'b_day': day, 'b_registers': sketch.to_bytes()})
+
+        table = PageViewSketch.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.viewed_user_id == bindparam('b_viewed'), table.c.day == bindparam('b_day'))
+            .values(registers=bindparam('b_registers')),
+            updates
+        )
+
+    @staticmethod
+    def rebuild_sketches():
+        """
+        Rebuilds page_view_sketch from the page_view table (backfill/repair),
+        streaming the distinct daily viewers. Returns the number of sketches.
+        """
+        day = func.date(PageView.timestamp)
+        distinct_viewers = (
+            db.session.query(PageView.viewed_user_id, day, PageView.viewer_user_id)
+            .distinct()
+            .order_by(PageView.viewed_user_id, day)
+            .yield_per(10000)
+        )
         try:
-            # Check if both users exist
-            viewed_user = User.query.get(viewed_user_id)
-            viewer_user = User.query.get(viewer_user_id)
-            if not viewed_user or not viewer_user:
-                return {'msg': 'User not found'}, 404
-
-            # Add the page view
-            page_view = PageView(viewed_user_id=viewed_user_id, viewer_user_id=viewer_user_id)
-            db.session.add(page_view)
+            db.session.query(PageViewSketch).delete(synchronize_session=False)
+            sketches = 0
+            current_key, sketch = None, None
+            for viewed, viewed_day, viewer in distinct_viewers:
+                if (viewed, viewed_day) != current_key:
+                    if sketch is not None:
+                        db.session.add(PageViewSketch(viewed_user_id=current_key[0], day=current_key[1],
+                                                      registers=sketch.to_bytes()))
+                        sketches += 1
+                    current_key, sketch = (viewed, viewed_day), HyperLogLog()
+                sketch.add(viewer)
+            if sketch is not None:
+                db.session.add(PageViewSketch(viewed_user_id=current_key[0], day=current_key[1],
+                                              registers=sketch.to_bytes()))
+                sketches += 1
             db.session.commit()
-            return {'msg': 'Page view added successfully'}, 201
+            return sketches
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def get_unique_viewers(user_id, start=None, end=None):
+        """
+        Approximate number of distinct viewers of a user between the start
+        and end days (inclusive, ISO dates; defaults to the last 7 days),
+        from the merged per-day sketches.
+        """
+        try:
+            end_day = datetime.fromisoformat(end).date() if end else datetime.utcnow().date()
+            start_day = datetime.fromisoformat(start).date() if start else end_day - timedelta(days=6)
+            if start_day > end_day:
+                raise ValueError("start must not be after end")
+
+            sketches = db.session.query(PageViewSketch.registers).filter(
+                PageViewSketch.viewed_user_id == user_id,
+                PageViewSketch.day.between(start_day, end_day),
+            ).yield_per(100)
+
+            merged = HyperLogLog()
+            for (registers,) in sketches:
+                merged.merge(HyperLogLog.from_bytes(registers))
+
+            return {
+                'unique_viewers': merged.count(),
+                'start': start_day.isoformat(),
+                'end': end_day.isoformat(),
+                'approximate': True,
+            }, 200
         except ValueError as e:
+            return {'msg': f'Invalid input: {str(e)}'}, 400
+
+    @staticmethod
+    def prune_bucket_viewers(retention_days):
+        """
+        Deletes the page_view_bucket_viewer rows of buckets that started more
+        than retention_days days ago. They only dedupe viewers of buckets
+        that still receive views; the rollups keep their unique_viewers and
+        the daily sketches cover longer ranges. One worker prunes at a time.
+        Returns the number of rows deleted.
+        """
+        cutoff = bucket_start(datetime.utcnow(), 'day') - timedelta(days=retention_days)
+        try:
+            if db.session.get_bind().dialect.name == 'postgresql' and not db.session.execute(
+                    select(func.pg_try_advisory_xact_lock(PRUNE_LOCK_ID))).scalar():
+                db.session.rollback()
+                return 0
+            deleted = db.session.query(PageViewBucketViewer)\
+                .filter(PageViewBucketViewer.bucket_start < cutoff)\
+                .delete(synchronize_session=False)
+            db.session.commit()
+            return deleted
+        except Exception:
             db.session.rollback()
-            return {'msg': f'Error adding page view: {str(e)}'}, 500
+            raise
 
     @staticmethod
-    def get_views_count_for_user(user_id):
+    def rebuild_rollups(viewer_retention_days=2):
+        """
+        Rebuilds page_view_rollup from the page_view table, and
+        page_view_bucket_viewer for the last viewer_retention_days days,
+        in one transaction (backfill/repair). Returns the number of rollup
+        buckets written.
+        """
+        cutoff = bucket_start(datetime.utcnow(), 'day') - timedelta(days=viewer_retention_days)
         try:
-            # Fetch all views for the specified user
-            views = PageView.query.filter_by(viewed_user_id=user_id).all()
-            if not views:
+            db.session.query(PageViewRollup).delete(synchronize_session=False)
+            db.session.query(PageViewBucketViewer).delete(synchronize_session=False)
+            for granularity in ROLLUP_GRANULARITIES:
+                bucket = func.date_trunc(granularity, PageView.timestamp)
+                db.session.execute(
+                    insert(PageViewBucketViewer).from_select(
+                        ['viewed_user_id', 'granularity', 'bucket_start', 'viewer_user_id'],
+                        select(PageView.viewed_user_id, literal(granularity), bucket, PageView.viewer_user_id)
+                        .where(PageView.timestamp >= cutoff)
+                        .distinct()
+                    )
+                )
+                db.session.execute(
+                    insert(PageViewRollup).from_select(
+                        ['viewed_user_id', 'granularity', 'bucket_start', 'view_count', 'unique_viewers'],
+                        select(PageView.viewed_user_id, literal(granularity), bucket,
+                               func.count(), func.count(distinct(PageView.viewer_user_id)))
+                        .group_by(PageView.viewed_user_id, bucket)
+                    )
+                )
+            rows = db.session.query(func.count()).select_from(PageViewRollup).scalar()
+            db.session.commit()
+            return rows
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def _rollup_query(user_id, granularity, start=None, end=None):
+        """Rollup buckets of a user whose start lies in [start floored to the bucket, end)."""
+        query = PageViewRollup.query.filter(
+            PageViewRollup.viewed_user_id == user_id,
+            PageViewRollup.granularity == granularity,
+        )
+        if start is not None:
+            query = query.filter(PageViewRollup.bucket_start >= bucket_start(start, granularity))
+        if end is not None:
+            query = query.filter(PageViewRollup.bucket_start < end)
+        return query
+
+    @staticmethod
+    def get_views_timeseries(user_id, granularity='day', start=None, end=None):
+        try:
+            if granularity not in ROLLUP_GRANULARITIES:
+                raise ValueError("granularity must be 'hour' or 'day'")
+            start = datetime.fromisoformat(start) if start else None
+            end = datetime.fromisoformat(end) if end else None
+
+            buckets = PageViewService._rollup_query(user_id, granularity, start, end)\
+                .order_by(PageViewRollup.bucket_start.asc()).all()
+            return {
+                'granularity': granularity,
+                'buckets': [bucket.to_dict() for bucket in buckets],
+                'count': sum(bucket.view_count for bucket in buckets),
+            }, 200
+        except ValueError as e:
+            return {'msg': f'Invalid input: {str(e)}'}, 400
+
+    @staticmethod
+    def get_views_count_for_user(user_id, start=None, end=None):
+        try:
+            # Sum the pre-aggregated buckets: day buckets for the whole history,
+            # hour buckets when a range is given
+            start = datetime.fromisoformat(start) if start else None
+            end = datetime.fromisoformat(end) if end else None
+            granularity = 'hour' if start or end else 'day'
+            views_count = PageViewService._rollup_query(user_id, granularity, start, end)\
+                .with_entities(func.coalesce(func.sum(PageViewRollup.view_count), 0)).scalar()
+            if not views_count:
                 return {'msg': 'No views found for this user'}, 404
 
-            # Serialize the views
-            views_count = len(views)
-            return {'count': views_count}, 200
+            return {'count': int(views_count)}, 200
         except ValueError as e:
-            return {'msg': f'Error retrieving views: {str(e)}'}, 500
+            return {'msg': f'Invalid input: {str(e)}'}, 400
     
     @staticmethod
-    def get_views_for_user(user_id, page=1, page_size=10, start_timestamp=None, end_timestamp=None):
+    def get_views_for_user(user_id, page=1, page_size=10, start_timestamp=None, end_timestamp=None,
+                           cursor=None, with_total=False):
         try:
             # Build the base query
             query = PageView.query.filter_by(viewed_user_id=user_id)
@@ -45,11 +533,34 @@ class PageViewService:
             if start_timestamp and end_timestamp:
                 query = query.filter(PageView.timestamp.between(start_timestamp, end_timestamp))
 
+            count_filters = {'user_id': str(user_id), 'start': start_timestamp, 'end': end_timestamp}
+            if cursor is not None:
+                # Keyset pagination on (timestamp, id), newest first
+                page_data = keyset_paginate(query, PageView.timestamp, PageView.id, cursor=cursor,
+                                            per_page=page_size, with_total=with_total,
+                                            endpoint='page_views', filters=count_filters)
+                views = page_data.pop("items")
+                result = {
+                    'views': [
+                        {
+                            'viewer_user': view.viewer_user.to_dict(),
+                            'timestamp': view.timestamp
+                        } for view in views
+                    ],
+                    'next_cursor': page_data['next_cursor'],
+                    'page_size': page_size,
+                }
+                if with_total:
+                    result['views_count'] = page_data['total']
+                    result['views_count_exact'] = page_data['total_exact']
+                return result, 200
+
             # Count total views
-            total_views = query.count()
+            total_views, total_exact = count_total(query, 'page_views', count_filters)
 
             # Apply pagination
-            views = query.offset((page - 1) * page_size).limit(page_size).all()
+            views = query.order_by(PageView.timestamp.desc(), PageView.id.desc())\
+                .offset((page - 1) * page_size).limit(page_size).all()
 
             # Serialize the views
             view_data = [
@@ -62,9 +573,12 @@ class PageViewService:
             return {
                 'views': view_data,
                 'views_count': total_views,
+                'views_count_exact': total_exact,
                 'page': page,
                 'page_size': page_size,
                 'total_pages': (total_views + page_size - 1) // page_size  # Calculate total pages
             }, 200
+        except ValueError as e:
+            return {'msg': str(e)}, 400
         except Exception as e:
             return {'msg': f'Error retrieving views: {str(e)}'}, 500
\ No newline at end of file
@@ -0,0 +1,351 @@
+from sqlalchemy import func, select, update, insert, union_all, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm.util import identity_key
+from models.user import User, Role, Course, Comment, CourseRatingStats, UserRatingStats
+from extensions import db
+from flask import current_app
+from _logger import CatchErrors, log
+from utils.cache import response_cache, course_key, profile_key
+from services.search_outbox_service import SearchOutboxService
+import threading
+import atexit
+import math
+
+RATING_VALUES = range(1, 6)
+HISTOGRAM_COLUMNS = [f"count_{i}" for i in RATING_VALUES] + ["rating_sum", "rating_count"]
+
+
+class RatingService:
+
+    @staticmethod
+    def _delta_values(old_rating, new_rating):
+        """
+        Column deltas for the stats tables when a comment's rating goes
+        from old_rating to new_rating (None means no rating / no comment).
+        """
+        values = {name: 0 for name in HISTOGRAM_COLUMNS}
+
+        if old_rating is not None:
+            if int(old_rating) in RATING_VALUES:
+                values[f"count_{int(old_rating)}"] -= 1
+            values["rating_sum"] -= int(old_rating)
+            values["rating_count"] -= 1
+        if new_rating is not None:
+            if int(new_rating) in RATING_VALUES:
+                values[f"count_{int(new_rating)}"] += 1
+            values["rating_sum"] += int(new_rating)
+            values["rating_count"] += 1
+        return values
+
+    @staticmethod
+    def _upsert_delta(model, key, values):
+        """
+        Adds `values` to the stats row of `model` with primary key `key`,
+        creating the row if needed, in a single statement. Runs in the
+        caller's transaction.
+        """
+        table = model.__table__
+        key_column = list(table.primary_key.columns)[0]
+        stmt = pg_insert(table).values({key_column.name: key, **values})
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key_column],
+            set_={name: table.c[name] + stmt.excluded[name] for name in values}
+        )
+        db.session.execute(stmt)
+
+        # The stats row (or owner.stats being None) may already be loaded in the session
+        loaded = db.session.identity_map.get(identity_key(model, key))
+        if loaded is not None:
+            db.session.expire(loaded)
+        owner_model = Course if model is CourseRatingStats else User
+        owner = db.session.identity_map.get(identity_key(owner_model, key))
+        if owner is not None:
+            db.session.expire(owner, ["stats"])
+
+    @staticmethod
+    def _owner_ids(course):
+        return {int(owner_id) for owner_id in (course.tutor_id, course.academy_id) if owner_id is not None}
+
+    @staticmethod
+    def invalidate_cached_course(course):
+        """
+        Drops the cached payloads of a course and of its tutor/academy
+        profiles after a committed change to its comments or rating.
+        """
+        response_cache.invalidate(
+            course_key(course.id),
+            *[profile_key(owner_id) for owner_id in RatingService._owner_ids(course)]
+        )
+
+    @staticmethod
+    def apply_comment_delta(course, old_rating=None, new_rating=None):
+        """
+        Applies a comment rating change to the stats rows of the course and
+        of its tutor/academy. Runs in the caller's transaction (no commit),
+        so the stats change commits together with the comment write.
+        """
+        if old_rating == new_rating:
+            return
+        values = RatingService._delta_values(old_rating, new_rating)
+
+        RatingService._upsert_delta(CourseRatingStats, int(course.id), values)
+        for owner_id in RatingService._owner_ids(course):
+            RatingService._upsert_delta(UserRatingStats, owner_id, values)
+
+    @staticmethod
+    def register_course(course):
+        """Adds a newly created (flushed) course to its owners' rollup."""
+        for owner_id in RatingService._owner_ids(course):
+            RatingService._upsert_delta(UserRatingStats, owner_id, {
+                "course_rating_sum": course.rating or 0,
+                "course_count": 1,
+            })
+
+    @staticmethod
+    def unregister_course(course):
+        """
+        Removes a course (its comment histogram and its rating) from its
+        owners' rollup and refreshes their ratings. Call before deleting
+        the course, in the same transaction.
+        """
+        owner_ids = RatingService._owner_ids(course)
+        if not owner_ids:
+            return
+        stats = course.stats
+        values = {name: -getattr(stats, name) if stats else 0 for name in HISTOGRAM_COLUMNS}
+        values["course_rating_sum"] = -(course.rating or 0)
+        values["course_count"] = -1
+        for owner_id in owner_ids:
+            RatingService._upsert_delta(UserRatingStats, owner_id, values)
+        RatingService.refresh_user_ratings(owner_ids)
+
+    @staticmethod
+    def refresh_course_ratings(course_ids):
+        """
+        Re-derives Course.rating from course_rating_stats for the given
+        courses and pushes each rating change into the owners' rollup.
+        Runs in the caller's transaction. Returns the affected owner ids.
+        """
+        course_ids = {int(course_id) for course_id in course_ids}
+        if not course_ids:
+            return set()
+
+        rows = (
+            db.session.query(
+                Course.id, Course.rating, Course.tutor_id, Course.academy_id,
+                CourseRatingStats.rating_sum, CourseRatingStats.rating_count
+            )
+            .outerjoin(CourseRatingStats, CourseRatingStats.course_id == Course.id)
+            .filter(Course.id.in_(course_ids))
+            .with_for_update(of=Course)
+            .all()
+        )
+
+        changed = []
+        owner_deltas = {}
+        for course_id, old_rating, tutor_id, academy_id, rating_sum, rating_count in rows:
+            # Round half up, like ROUND() in the rebuild queries
+            new_rating = float(math.floor(rating_sum / rating_count + 0.5)) if rating_count else 0
+            old_rating = old_rating or 0
+            if new_rating == old_rating:
+                continue
+            changed.append({"b_id": course_id, "b_rating": new_rating})
+            for owner_id in (tutor_id, academy_id):
+                if owner_id is not None:
+                    owner_deltas[owner_id] = owner_deltas.get(owner_id, 0) + new_rating - old_rating
+
+        if changed:
+            course_table = Course.__table__
+            db.session.execute(
+                update(course_table)
+                .where(course_table.c.id == bindparam("b_id"))
+                .values(rating=bindparam("b_rating")),
+                changed
+            )
+            for row in changed:
+                course = db.session.identity_map.get(identity_key(Course, row["b_id"]))
+                if course is not None:
+                    db.session.expire(course, ["rating"])
+        for owner_id, delta in owner_deltas.items():
+            RatingService._upsert_delta(UserRatingStats, owner_id, {"course_rating_sum": delta})
+
+        return set(owner_deltas)
+
+    @staticmethod
+    def refresh_user_ratings(user_ids):
+        """
+        Sets User.rating (average of the user's course ratings) from
+        user_rating_stats in one statement. Runs in the caller's transaction.
+        """
+        user_ids = {int(user_id) for user_id in user_ids}
+        if not user_ids:
+            return
+        average = (
+            select(func.round(UserRatingStats.course_rating_sum / func.nullif(UserRatingStats.course_count, 0)))
+            .where(UserRatingStats.user_id == User.id)
+            .scalar_subquery()
+        )
+        db.session.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(rating=func.coalesce(average, 0))
+            .execution_options(synchronize_session="fetch")
+        )
+
+    @staticmethod
+    def rebuild_course_stats():
+        """
+        Rebuilds course_rating_stats from the comment table and re-derives
+        Course.rating from it, in one transaction. Used to backfill existing
+        data and to repair drift. Returns the number of stats rows written.
+        """
+        columns = [Comment.course_id]
+        columns += [func.count(Comment.id).filter(Comment.rating == i) for i in RATING_VALUES]
+        columns += [func.sum(Comment.rating), func.count(Comment.rating)]
+        aggregated = (
+            select(*columns)
+            .where(Comment.course_id.isnot(None), Comment.rating.isnot(None))
+            .group_by(Comment.course_id)
+        )
+
+        try:
+            db.session.query(CourseRatingStats).delete(synchronize_session=False)
+            db.session.execute(
+                insert(CourseRatingStats).from_select(["course_id"] + HISTOGRAM_COLUMNS, aggregated)
+            )
+            average = (
+                select(func.round(CourseRatingStats.rating_sum * 1.0 / func.nullif(CourseRatingStats.rating_count, 0)))
+                .where(CourseRatingStats.course_id == Course.id)
+                .scalar_subquery()
+            )
+            db.session.execute(update(Course).values(rating=func.coalesce(average, 0)))
+            rows = db.session.query(func.count(CourseRatingStats.course_id)).scalar()
+            db.session.commit()
+            return rows
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @staticmethod
+    def rebuild_user_stats():
+        """
+        Rebuilds user_rating_stats from course and course_rating_stats and
+        re-derives User.rating, in one transaction. Run after
+        rebuild_course_stats(). Returns the number of stats rows written.
+        """
+        def owned_courses(owner_column):
+            columns = [owner_column.label("user_id")]
+            columns += [func.coalesce(getattr(CourseRatingStats, name), 0).label(name) for name in HISTOGRAM_COLUMNS]
+            columns += [func.coalesce(Course.rating, 0).label("course_rating")]
+            return (
+                select(*columns)
+                .select_from(Course)
+                .outerjoin(CourseRatingStats, CourseRatingStats.course_id == Course.id)
+                .where(owner_column.isnot(None))
+            )
+
+        owned = union_all(owned_courses(Course.tutor_id), owned_courses(Course.academy_id)).subquery()
+        aggregated = (
+            select(
+                owned.c.user_id,
+                *[func.sum(owned.c[name]) for name in HISTOGRAM_COLUMNS],
+                func.sum(owned.c.course_rating),
+                func.count(),
+            )
+            .group_by(owned.c.user_id)
+        )
+
+        try:
+            db.session.query(UserRatingStats).delete(synchronize_session=False)
+            db.session.execute(
+                insert(UserRatingStats).from_select(
+                    ["user_id"] + HISTOGRAM_COLUMNS + ["course_rating_sum", "course_count"],
+                    aggregated
+                )
+            )
+            average = (
+                select(func.round(UserRatingStats.course_rating_sum / func.nullif(UserRatingStats.course_count, 0)))
+                .where(UserRatingStats.user_id == User.id)
+                .scalar_subquery()
+            )
+            db.session.execute(
+                update(User)
+                .where(User.role.in_([Role.TUTOR, Role.ACADEMY]))
+                .values(rating=func.coalesce(average, 0))
+            )
+            rows = db.session.query(func.count(UserRatingStats.user_id)).scalar()
+            db.session.commit()
+            return rows
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+class RatingRecomputeQueue:
+    """
+    In-process debounced queue of courses whose Course.rating / owners'
+    User.rating must be re-derived from the stats tables. The first
+    enqueue opens a window of RATING_RECOMPUTE_DELAY seconds; every course
+    enqueued meanwhile is coalesced and flushed in one batch and one
+    commit, so a burst of reviews costs one recompute. The stats tables
+    themselves are always up to date; a lost batch is fixed by the next
+    write to the course or by `flask rebuild-rating-stats`.
+    """
+
+    def __init__(self, delay=2.0):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._timer = None
+        self._app = None
+        atexit.register(self.flush)
+
+    def enqueue(self, course_id):
+        app = current_app._get_current_object()
+        with self._lock:
+            self._pending.add(int(course_id))
+            self._app = app
+            if self._timer is None:
+                self._timer = threading.Timer(app.config.get("RATING_RECOMPUTE_DELAY", self.delay), self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            course_ids, self._pending = self._pending, set()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            app = self._app
+        if course_ids and app is not None:
+            with app.app_context():
+                self._recompute(course_ids)
+
+    @CatchErrors()
+    def _recompute(self, course_ids):
+        try:
+            owner_ids = RatingService.refresh_course_ratings(course_ids)
+            RatingService.refresh_user_ratings(owner_ids)
+            # Every course of an owner embeds the owner's (tutor/academy) rating
+            owned_ids = set(course_ids)
+            if owner_ids:
+                owned_ids.update(course_id for (course_id,) in db.session.query(Course.id).filter(
+                    Course.tutor_id.in_(owner_ids) | Course.academy_id.in_(owner_ids)
+                ))
+            # Search documents carry the course/user ratings and rating stats
+            SearchOutboxService.enqueue_courses(owned_ids)
+            SearchOutboxService.enqueue_users(owner_ids)
+            db.session.commit()
+            response_cache.invalidate(
+                *[course_key(course_id) for course_id in owned_ids],
+                *[profile_key(owner_id) for owner_id in owner_ids]
+            )
+            log(f"Recomputed ratings for {len(course_ids)} courses and {len(owner_ids)} users")
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+rating_queue = RatingRecomputeQueue()
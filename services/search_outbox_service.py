@@ -0,0 +1,233 @@
+from models.user import User, Course, SearchOutbox
+from extensions import db, es
+from services.indexing_service import IndexingService, USERS_INDEX, COURSES_INDEX
+from utils.metrics import register_metrics
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload
+from datetime import timedelta
+from sqlalchemy import func
+import logging
+import threading
+import time
+import os
+
+_PENDING_KEY = "search_outbox_pending"
+
+
+class SearchOutboxService:
+    """
+    Writes search index changes to the search_outbox table in the caller's
+    transaction (no commit, no ES call): the change reaches Elasticsearch
+    if and only if the entity change commits.
+    """
+
+    @staticmethod
+    def _enqueue(index_name, document_ids, operation):
+        rows = [
+            SearchOutbox(index_name=index_name, document_id=int(document_id), operation=operation)
+            for document_id in set(document_ids) if document_id is not None
+        ]
+        if rows:
+            db.session.add_all(rows)
+            db.session.info[_PENDING_KEY] = True
+
+    @staticmethod
+    def enqueue_users(user_ids, operation='index'):
+        SearchOutboxService._enqueue(USERS_INDEX, user_ids, operation)
+
+    @staticmethod
+    def enqueue_courses(course_ids, operation='index'):
+        SearchOutboxService._enqueue(COURSES_INDEX, course_ids, operation)
+
+    @staticmethod
+    def enqueue_courses_of_user(user_id):
+        """Course documents embed the tutor/academy summary of their owner."""
+        course_ids = [
+            course_id for (course_id,) in db.session.query(Course.id).filter(
+                (Course.tutor_id == user_id) | (Course.academy_id == user_id)
+            )
+        ]
+        SearchOutboxService.enqueue_courses(course_ids)
+
+
+class SearchOutboxDispatcher:
+    """
+    Background worker draining search_outbox into Elasticsearch. Each cycle
+    claims up to SEARCH_OUTBOX_BATCH_SIZE due rows with FOR UPDATE SKIP
+    LOCKED (so every worker process can run one), keeps the newest change
+    per document, builds the documents from the current rows and sends
+    them in one bulk request. Writes use external versioning with the
+    outbox id, so an older change can never overwrite a newer one.
+    Dispatched rows are deleted; failed ones are retried with exponential
+    backoff until SEARCH_OUTBOX_MAX_ATTEMPTS, then kept for inspection.
+    The worker wakes up on commits that wrote outbox rows, and every
+    SEARCH_OUTBOX_POLL_INTERVAL_MS otherwise.
+    """
+
+    def __init__(self, batch_size=500, poll_interval_ms=1000, max_attempts=10):
+        self.batch_size = batch_size
+        self.poll_interval_ms = poll_interval_ms
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._app = None
+        self._counters = {
+            "dispatched": 0,
+            "superseded": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_batch_ms": 0.0,
+        }
+
+    def _ensure_started(self):
+        # Started lazily, and again in a forked worker (threads don't survive fork)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            app = current_app._get_current_object()
+            self.batch_size = app.config.get("SEARCH_OUTBOX_BATCH_SIZE", self.batch_size)
+            self.poll_interval_ms = app.config.get("SEARCH_OUTBOX_POLL_INTERVAL_MS", self.poll_interval_ms)
+            self.max_attempts = app.config.get("SEARCH_OUTBOX_MAX_ATTEMPTS", self.max_attempts)
+            self._app = app
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="search-outbox", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Wakes the worker up (starting it if needed) after outbox rows were committed."""
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval_ms / 1000.0)
+            self._wakeup.clear()
+            with self._app.app_context():
+                # Keep going while full batches come back
+                while self.dispatch_batch() == self.batch_size:
+                    pass
+
+    def _documents(self, index_name, document_ids):
+        """Current documents of the given ids; ids missing from Postgres map to None."""
+        if index_name == USERS_INDEX:
+            rows = User.query.filter(User.id.in_(document_ids)).all()
+            return {user.id: IndexingService.user_document(user) for user in rows}
+        rows = Course.query.options(
+            joinedload(Course.tutor), joinedload(Course.academy), joinedload(Course.stats)
+        ).filter(Course.id.in_(document_ids)).all()
+        return {course.id: IndexingService.course_document(course) for course in rows}
+
+    def _actions(self, latest):
+        ids_by_index = {}
+        for (index_name, document_id), row in latest.items():
+            if row.operation == 'index':
+                ids_by_index.setdefault(index_name, []).append(document_id)
+        documents = {
+            index_name: self._documents(index_name, document_ids)
+            for index_name, document_ids in ids_by_index.items()
+        }
+
+        for (index_name, document_id), row in latest.items():
+            action = {
+                "_index": index_name,
+                "_id": document_id,
+                "version": row.id,
+                "version_type": "external",
+            }
+            document = documents.get(index_name, {}).get(document_id)
+            if row.operation == 'delete' or document is None:
+                action["_op_type"] = "delete"
+            else:
+                action["_op_type"] = "index"
+                action["_source"] = document
+            yield action
+
+    def dispatch_batch(self):
+        """
+        Sends one batch of due outbox rows to Elasticsearch and commits the
+        outcome. Returns the number of rows claimed.
+        """
+        from elasticsearch import helpers
+
+        started = time.monotonic()
+        try:
+            rows = (
+                SearchOutbox.query
+                .filter(SearchOutbox.next_attempt_at <= func.now(), SearchOutbox.attempts < self.max_attempts)
+                .order_by(SearchOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not rows:
+                db.session.commit()
+                return 0
+
+            # Newest change per document wins, older rows are superseded
+            latest = {}
+            for row in rows:
+                latest[(row.index_name, row.document_id)] = row
+
+            # Without in-call retries streaming_bulk yields one result per action, in
+            # the order of `latest`; rejected (429) documents are retried by the backoff
+            results = helpers.streaming_bulk(es, self._actions(latest), chunk_size=self.batch_size,
+                                             raise_on_error=False, raise_on_exception=False)
+            errors = {}
+            for key, (ok, item) in zip(latest, results):
+                op_type, result = next(iter(item.items()))
+                status = result.get("status", 0)
+                # 409: a newer version is already indexed; 404: deleting a missing document
+                if not ok and status != 409 and not (op_type == "delete" and status == 404):
+                    errors[key] = str(result.get("error"))
+
+            dispatched = failed = 0
+            for row in rows:
+                key = (row.index_name, row.document_id)
+                error = errors.get(key) if latest[key] is row else None
+                if error is None:
+                    db.session.delete(row)
+                    dispatched += 1
+                else:
+                    row.attempts += 1
+                    row.last_error = error[:1000]
+                    row.next_attempt_at = func.now() + timedelta(seconds=min(2 ** row.attempts, 3600))
+                    failed += 1
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logging.getLogger(__name__).exception("Search outbox dispatch failed")
+            return 0
+        finally:
+            db.session.remove()
+
+        with self._lock:
+            self._counters["dispatched"] += dispatched
+            self._counters["superseded"] += len(rows) - len(latest)
+            self._counters["failed"] += failed
+            self._counters["batches"] += 1
+            self._counters["last_batch_ms"] = round((time.monotonic() - started) * 1000, 2)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+search_outbox = SearchOutboxDispatcher()
+register_metrics("search_outbox", search_outbox.stats)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_dispatcher(session):
+    if session.info.pop(_PENDING_KEY, False):
+        search_outbox.notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending(session):
+    session.info.pop(_PENDING_KEY, None)
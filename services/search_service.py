@@ -1,164 +1,369 @@
 from sqlalchemy.orm import joinedload
-from models.user import User, Course, Favorites  # Import your favorite model
+from models.user import User, Course
 from extensions import es, db
 from _logger import log
+from utils.counting import count_total
+from sqlalchemy import or_
+from services.indexing_service import USERS_INDEX, COURSES_INDEX
+from services.favorites_service import FavoritesService
+from utils.cache import LocalCache
+from utils.metrics import register_metrics
+from utils.geo import within_radius
+from utils.db_routing import read_only
+from services.location_service import LocationService, normalize_name
+from flask import current_app
+
+# Suggestions of the most common prefixes (see SearchService.suggest)
+suggest_cache = LocalCache(max_entries=2048)
+register_metrics("suggest_cache", lambda: {**suggest_cache.counters, "entries": len(suggest_cache)})
+
+
+def _es_errors():
+    # elasticsearch is imported with the first search, not at startup
+    from elasticsearch import ApiError, TransportError
+    return ApiError, TransportError
+
 
 class SearchService:
     @staticmethod
-    def search_users(search_query: str, user_id=None, page=1, per_page=10, sort_by_rating=None, location=None):
+    def _text_query(search_query, fields):
         """
-        Search for users by `name` or `username` in Elasticsearch.
-        Returns users with an `is_favorite` field if user_id is provided.
+        Full-word, prefix and substring matching on `fields` through their
+        analyzed subfields (see INDEX_DEFINITIONS), instead of *query*
+        wildcards that scan the whole term dictionary.
         """
-        try:
-            if not search_query:
-                raise ValueError("Search query cannot be empty")
-
-            es_query = {
-                "query": {
-                    "bool": {
-                        "should": [
-                            {"match": {"name": search_query}},
-                            {"match": {"surname": search_query}},
-                            {"wildcard": {"name": {"value": f"*{search_query}*", "boost": 1.0}}},
-                            {"wildcard": {"surname": {"value": f"*{search_query}*", "boost": 1.0}}}
-                        ],
-                        "minimum_should_match": 1
-                    }
-                },
-                "sort": [{"_score": {"order": "desc"}}],
-                "from": (page - 1) * per_page,
-                "size": per_page
+        return {
+            "bool": {
+                "should": [
+                    {"multi_match": {"query": search_query, "fields": [f"{f}^3" for f in fields]}},
+                    {"multi_match": {"query": search_query, "fields": [f"{f}.prefix^2" for f in fields],
+                                     "operator": "and"}},
+                    {"multi_match": {"query": search_query, "fields": [f"{f}.ngram" for f in fields],
+                                     "minimum_should_match": "75%"}},
+                ],
+                "minimum_should_match": 1,
             }
+        }
+
+    @staticmethod
+    def _user_search_body(search_query, page, per_page, sort_by_rating, location, min_rating, near=None):
+        """Elasticsearch request with the text query, location/rating/near filters, sort and pagination."""
+        filters = []
+        if location:
+            filters.append({"term": {"location.normalized": normalize_name(location)}})
+        if min_rating:
+            filters.append({"range": {"rating": {"gte": min_rating}}})
+        if near:
+            lat, lon, radius_km = near
+            filters.append({"geo_distance": {"distance": f"{radius_km}km", "geo": {"lat": lat, "lon": lon}}})
 
-            response = es.search(index="users", body=es_query)
-            user_ids = [hit["_source"]["_id"] for hit in response['hits']['hits']]
+        # Relevance order unless a rating sort is asked for (relevance breaks ties)
+        sort = []
+        if sort_by_rating and sort_by_rating.lower() in ["asc", "desc"]:
+            sort.append({"rating": {"order": sort_by_rating.lower()}})
+        sort.append({"_score": {"order": "desc"}})
 
-            users_query = db.session.query(User)
-            if user_ids:
-                users_query = users_query.filter(User.id.in_(user_ids))
+        return {
+            "query": {
+                "bool": {
+                    "must": [SearchService._text_query(search_query, ["name", "surname"])],
+                    "filter": filters,
+                }
+            },
+            "sort": sort,
+            "from": (page - 1) * per_page,
+            "size": per_page,
+            "track_total_hits": True,
+            "_source": False,
+        }
 
-            if location:
-                users_query = users_query.filter(User.location == location)
+    @staticmethod
+    def _search_users_db(search_query, page, per_page, sort_by_rating, location, min_rating, near=None):
+        """
+        Postgres fallback of search_users() when Elasticsearch is unavailable:
+        ILIKE on name/surname with the same filters and sort.
+        Returns (users, total, total_exact).
+        """
+        pattern = f"%{search_query}%"
+        users_query = User.query.filter(or_(User.name.ilike(pattern), User.surname.ilike(pattern)))
+        if location:
+            users_query = users_query.filter(LocationService.city_filter(User.city_id, location))
+        if min_rating:
+            users_query = users_query.filter(User.rating >= min_rating)
+        if near:
+            users_query = users_query.filter(within_radius(User.latitude, User.longitude, *near))
+        if sort_by_rating and sort_by_rating.lower() == "asc":
+            users_query = users_query.order_by(User.rating.asc())
+        elif sort_by_rating and sort_by_rating.lower() == "desc":
+            users_query = users_query.order_by(User.rating.desc())
+        users_query = users_query.order_by(User.id.desc())
 
-            if sort_by_rating:
-                if sort_by_rating.lower() == "asc":
-                    users_query = users_query.order_by(User.rating.asc())
-                elif sort_by_rating.lower() == "desc":
-                    users_query = users_query.order_by(User.rating.desc())
+        total, total_exact = count_total(users_query, "search_users", {
+            "query": search_query, "location": location, "min_rating": min_rating, "near": near
+        })
+        users = users_query.limit(per_page).offset((page - 1) * per_page).all()
+        return users, total, total_exact
 
-            total = users_query.count()
-            users_query = users_query.limit(per_page).offset((page - 1) * per_page)
-            users = users_query.all()
+    @staticmethod
+    def _users_page(users, favorite_user_ids, total, total_exact, page, per_page):
+        """Response of search_users from serialized users."""
+        return {
+            "users": [{**u, "is_favorite": u["id"] in favorite_user_ids} for u in users],
+            "total": total,
+            "total_exact": total_exact,
+            "page": page,
+            "per_page": per_page,
+            "total_pages": (total + per_page - 1) // per_page
+        }
+
+    @staticmethod
+    def _courses_page(courses, favorite_course_ids, total, total_exact, page, per_page):
+        """Response of search_courses from course documents."""
+        return {
+            "courses": [{**c, "is_favorite": c["id"] in favorite_course_ids} for c in courses],
+            "total": total,
+            "total_exact": total_exact,
+            "page": page,
+            "per_page": per_page,
+            "total_pages": (total + per_page - 1) // per_page
+        }
+
+    @staticmethod
+    @read_only
+    def search_users(search_query: str, user_id=None, page=1, per_page=10, sort_by_rating=None, location=None,
+                     min_rating=None, near=None):
+        """
+        Search for users by `name` or `surname` in Elasticsearch.
+        Filters, sort and pagination run in ES and the page keeps the ES
+        order (relevance, or rating when sort_by_rating is set); only the
+        page's users are loaded from Postgres, in one query. Postgres search
+        is only used when ES is unavailable.
+        near=(lat, lon, radius_km) keeps the users within the radius.
+        Returns users with an `is_favorite` field if user_id is provided
+        (from the cached FavoritesService.get_favorite_ids).
+        """
+        try:
+            if not search_query:
+                raise ValueError("Search query cannot be empty")
+
+            search_args = (search_query, page, per_page, sort_by_rating, location, min_rating, near)
+            try:
+                response = es.search(index=USERS_INDEX, body=SearchService._user_search_body(*search_args))
+                user_ids = [int(hit["_id"]) for hit in response['hits']['hits']]
+                total = response['hits']['total']['value']
+                total_exact = response['hits']['total']['relation'] == 'eq'
+
+                # Hydrate the page only, then restore the ES order
+                users_by_id = {}
+                if user_ids:
+                    users_by_id = {u.id: u for u in User.query.filter(User.id.in_(user_ids)).all()}
+                users = [users_by_id[hit_id] for hit_id in user_ids if hit_id in users_by_id]
+            except _es_errors() as e:
+                log(f"User search falls back to Postgres: {e}")
+                users, total, total_exact = SearchService._search_users_db(*search_args)
 
             # --- Favorites check ---
-            favorite_user_ids = set()
-            if user_id:
-                favorites = db.session.query(Favorites).filter_by(user_id=user_id).all()
-                favorite_user_ids = {fav.target_user_id for fav in favorites}
-            
-            result = []
-            for u in users:
-                data = u.to_dict()
-                data["is_favorite"] = u.id in favorite_user_ids
-                result.append(data)
-
-            total_pages = (total + per_page - 1) // per_page
-            return {
-                "users": result,
-                "total": total,
-                "page": page,
-                "per_page": per_page,
-                "total_pages": total_pages
-            }
+            favorite_user_ids = FavoritesService.get_favorite_ids(user_id).user_ids if user_id else frozenset()
+            return SearchService._users_page([u.to_dict() for u in users], favorite_user_ids,
+                                             total, total_exact, page, per_page)
 
         except ValueError as e:
             return {'msg': f'Error in elasticsearch: {str(e)}'}, 500
 
     @staticmethod
+    def _parse_online(online):
+        if online is None or isinstance(online, bool):
+            return online
+        return str(online).lower() in ['true', '1', 'yes']
+
+    @staticmethod
+    def _course_search_body(search_query, page, per_page, sort_by_price, sort_by_rating,
+                            online, city, district, start_time, end_time, near=None):
+        """Elasticsearch request with the text query, filters, sorts and pagination."""
+        filters = []
+        if city:
+            filters.append({"term": {"city.normalized": normalize_name(city)}})
+        if district:
+            filters.append({"term": {"district.normalized": normalize_name(district)}})
+        if online is not None:
+            filters.append({"term": {"online": online}})
+        if start_time:
+            filters.append({"range": {"start_time": {"gte": start_time}}})
+        if end_time:
+            filters.append({"range": {"end_time": {"lte": end_time}}})
+        if near:
+            lat, lon, radius_km = near
+            filters.append({"geo_distance": {"distance": f"{radius_km}km", "geo": {"lat": lat, "lon": lon}}})
+
+        # Same precedence as before: price, then rating, then relevance
+        sort = []
+        if sort_by_price:
+            sort.append({"price": {"order": "asc" if sort_by_price.lower() == "asc" else "desc"}})
+        if sort_by_rating:
+            sort.append({"rating": {"order": "asc" if sort_by_rating.lower() == "asc" else "desc"}})
+        sort.append({"_score": {"order": "desc"}})
+
+        return {
+            "query": {
+                "bool": {
+                    "must": [SearchService._text_query(search_query, ["title", "description"])],
+                    "filter": filters,
+                }
+            },
+            "sort": sort,
+            "from": (page - 1) * per_page,
+            "size": per_page,
+            "track_total_hits": True,
+            "_source": {"excludes": ["suggest"]},
+        }
+
+    @staticmethod
+    def _search_courses_db(search_query, page, per_page, sort_by_price, sort_by_rating,
+                           online, city, district, start_time, end_time, near=None):
+        """
+        Postgres fallback of search_courses() when Elasticsearch is unavailable:
+        ILIKE on title/description with the same filters and sorts.
+        Returns (course dicts, total, total_exact).
+        """
+        pattern = f"%{search_query}%"
+        courses_query = db.session.query(Course).options(
+            joinedload(Course.tutor), joinedload(Course.academy)
+        ).filter(or_(Course.title.ilike(pattern), Course.description.ilike(pattern)))
+
+        if city:
+            courses_query = courses_query.filter(LocationService.city_filter(Course.city_id, city))
+        if district:
+            courses_query = courses_query.filter(LocationService.district_filter(Course.district_id, district, city))
+        if start_time:
+            courses_query = courses_query.filter(Course.start_time >= start_time)
+        if end_time:
+            courses_query = courses_query.filter(Course.end_time <= end_time)
+        if online is not None:
+            courses_query = courses_query.filter(Course.online == online)
+        if near:
+            courses_query = courses_query.filter(within_radius(Course.latitude, Course.longitude, *near))
+
+        if sort_by_price:
+            courses_query = courses_query.order_by(
+                Course.price.asc() if sort_by_price.lower() == 'asc' else Course.price.desc()
+            )
+        if sort_by_rating:
+            courses_query = courses_query.order_by(
+                Course.rating.asc() if sort_by_rating.lower() == 'asc' else Course.rating.desc()
+            )
+        courses_query = courses_query.order_by(Course.id.desc())
+
+        total, total_exact = count_total(courses_query, "search_courses", {
+            "query": search_query, "online": online, "city": city, "district": district,
+            "start_time": start_time, "end_time": end_time, "near": near
+        })
+        courses = courses_query.limit(per_page).offset((page - 1) * per_page).all()
+        rating_stats = Course.get_rating_stats_for_courses([c.id for c in courses])
+        return [c.to_dict(rating_stats=rating_stats[c.id]) for c in courses], total, total_exact
+
+    @staticmethod
+    @read_only
     def search_courses(search_query: str, user_id=None, page=1, per_page=10,
                        sort_by_price=None, sort_by_rating=None,
                        online=None, city=None, district=None,
-                       start_time=None, end_time=None):
+                       start_time=None, end_time=None, near=None):
         """
         Search for courses by `title` or `description` in Elasticsearch with personalization.
-        Adds `is_favorite` if user_id is provided.
+        Filters, sorts and pagination run in one ES request and results are
+        built from the indexed documents (see IndexingService.course_document);
+        Postgres is only used when ES is unavailable.
+        near=(lat, lon, radius_km) keeps the courses within the radius.
+        Adds `is_favorite` if user_id is provided (from the cached
+        FavoritesService.get_favorite_ids).
         """
         try:
             if not search_query:
                 raise ValueError("Search query cannot be empty")
 
-            es_query = {
-                "query": {
-                    "bool": {
-                        "should": [
-                            {"match": {"title": search_query}},
-                            {"match": {"description": search_query}},
-                            {"wildcard": {"title": {"value": f"*{search_query}*", "boost": 1.0}}},
-                            {"wildcard": {"description": {"value": f"*{search_query}*", "boost": 1.0}}}
-                        ],
-                        "minimum_should_match": 1,
-                    }
-                },
-                "sort": [],
-                "from": (page - 1) * per_page,
-                "size": per_page
-            }
-
-            response = es.search(index="courses", body=es_query)
-            course_ids = [hit["_id"] for hit in response['hits']['hits']]
-
-            courses_query = db.session.query(Course).options(
-                joinedload(Course.tutor), joinedload(Course.academy)
-            )
-
-            if course_ids:
-                courses_query = courses_query.filter(Course.id.in_(course_ids))
-
-            if city:
-                courses_query = courses_query.filter(Course.city == city)
-            if district:
-                courses_query = courses_query.filter(Course.district == district)
-            if start_time:
-                courses_query = courses_query.filter(Course.start_time >= start_time)
-            if end_time:
-                courses_query = courses_query.filter(Course.end_time <= end_time)
-            if online is not None:
-                courses_query = courses_query.filter(Course.online == online)
-
-            if sort_by_price:
-                courses_query = courses_query.order_by(
-                    Course.price.asc() if sort_by_price.lower() == 'asc' else Course.price.desc()
-                )
-            if sort_by_rating:
-                courses_query = courses_query.order_by(
-                    Course.rating.asc() if sort_by_rating.lower() == 'asc' else Course.rating.desc()
-                )
-
-            total = courses_query.count()
-            courses_query = courses_query.limit(per_page).offset((page - 1) * per_page)
-            courses = courses_query.all()
+            online = SearchService._parse_online(online)
+            search_args = (search_query, page, per_page, sort_by_price, sort_by_rating,
+                           online, city, district, start_time, end_time, near)
+            try:
+                response = es.search(index=COURSES_INDEX, body=SearchService._course_search_body(*search_args))
+                courses = [hit["_source"] for hit in response['hits']['hits']]
+                total = response['hits']['total']['value']
+                total_exact = response['hits']['total']['relation'] == 'eq'
+            except _es_errors() as e:
+                log(f"Course search falls back to Postgres: {e}")
+                courses, total, total_exact = SearchService._search_courses_db(*search_args)
 
             # --- Favorites check ---
-            favorite_course_ids = set()
-            if user_id:
-                favorites = db.session.query(Favorites).filter_by(user_id=user_id).all()
-                favorite_course_ids = {fav.course_id for fav in favorites}
-
-            result = []
-            for c in courses:
-                data = c.to_dict()
-                data["is_favorite"] = c.id in favorite_course_ids
-                result.append(data)
-
-            total_pages = (total + per_page - 1) // per_page
-            return {
-                "courses": result,
-                "total": total,
-                "page": page,
-                "per_page": per_page,
-                "total_pages": total_pages
-            }
+            favorite_course_ids = FavoritesService.get_favorite_ids(user_id).course_ids if user_id else frozenset()
+            return SearchService._courses_page(courses, favorite_course_ids, total, total_exact, page, per_page)
 
         except ValueError as e:
             return {'msg': f'Error in elasticsearch: {str(e)}'}, 500
+
+    @staticmethod
+    def _suggest_options(response):
+        # A failed sub-search comes back as {"error": ...} without suggestions
+        return response.get("suggest", {}).get("suggestions", [{}])[0].get("options", [])
+
+    @staticmethod
+    def suggest(prefix: str, size=5):
+        """
+        Search-as-you-type: course titles and tutor/academy names starting
+        with `prefix`, from the completion fields of both indices in one
+        msearch round trip. Returns ids and display strings only:
+        {"courses": [{"id", "text"}], "users": [{"id", "text", "role"}]}.
+        Short prefixes (up to SUGGEST_CACHE_MAX_PREFIX characters) are cached
+        in-process for SUGGEST_CACHE_TTL seconds.
+        """
+        prefix = (prefix or "").strip().lower()
+        if not prefix:
+            raise ValueError("Prefix cannot be empty")
+        size = max(1, min(int(size), 20))
+
+        config = current_app.config
+        cacheable = len(prefix) <= config.get("SUGGEST_CACHE_MAX_PREFIX", 4)
+        cache_key = (prefix, size)
+        if cacheable:
+            cached = suggest_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        def request(index, source):
+            return [
+                {"index": index},
+                {
+                    "_source": source,
+                    "suggest": {
+                        "suggestions": {
+                            "prefix": prefix,
+                            "completion": {"field": "suggest", "size": size, "skip_duplicates": True},
+                        }
+                    },
+                },
+            ]
+
+        try:
+            courses_response, users_response = es.msearch(
+                searches=request(COURSES_INDEX, ["title"]) + request(USERS_INDEX, ["name", "surname", "role"])
+            )["responses"]
+        except _es_errors() as e:
+            log(f"Suggest failed: {e}")
+            return {"courses": [], "users": []}
+
+        result = {
+            "courses": [
+                {"id": int(option["_id"]), "text": option["_source"].get("title")}
+                for option in SearchService._suggest_options(courses_response)
+            ],
+            "users": [
+                {
+                    "id": int(option["_id"]),
+                    "text": " ".join(part for part in (option["_source"].get("name"),
+                                                       option["_source"].get("surname")) if part),
+                    "role": option["_source"].get("role"),
+                }
+                for option in SearchService._suggest_options(users_response)
+            ],
+        }
+        if cacheable:
+            suggest_cache.set(cache_key, result, config.get("SUGGEST_CACHE_TTL", 30))
+        return result
@@ -1,14 +1,23 @@
-from models.user import User, Role, Favorites
-from extensions import db, es
+from models.user import User, Role, Course
+from extensions import db
 import base64
-from sqlalchemy import desc
+from sqlalchemy import desc, func, union_all, select
+from sqlalchemy.orm import joinedload
 from werkzeug.utils import secure_filename 
 from models.user import User
 import os 
 from _logger import log
+from utils.pagination import keyset_paginate
+from utils.counting import paginate
+from utils.cache import response_cache, course_key, profile_key
+from services.favorites_service import FavoritesService
+from services.search_outbox_service import SearchOutboxService
+from services.location_service import LocationService
+from utils.geo import within_radius, parse_coordinates
+from utils.db_routing import read_only
+from werkzeug.exceptions import BadRequest
 
 MEDIA_FOLDER = '/media/profiles'
-os.makedirs(MEDIA_FOLDER, exist_ok=True)
 
 class UserService:
     @staticmethod
@@ -20,8 +29,25 @@ class UserService:
 
     @staticmethod
     def get_profile(user_id):
-        user = UserService.get_user_by_id(user_id)
-        return user.to_dict_profile()
+        # Cached payload, invalidated by profile, course and comment writes.
+        # Loaded from the primary: a lagging replica would cache a stale profile for CACHE_TTL
+        return response_cache.get_or_set(
+            profile_key(user_id),
+            lambda: UserService.get_user_by_id(user_id).to_dict_profile()
+        )
+
+    @staticmethod
+    def invalidate_cached_user(user_id):
+        """
+        Drops the cached profile of a user and the cached payloads of their
+        courses (which embed the tutor/academy). Call after the commit.
+        """
+        course_ids = [
+            course_id for (course_id,) in db.session.query(Course.id).filter(
+                (Course.tutor_id == user_id) | (Course.academy_id == user_id)
+            )
+        ]
+        response_cache.invalidate(profile_key(user_id), *[course_key(course_id) for course_id in course_ids])
 
     @staticmethod
     def update_user(user_id, update_data):
@@ -31,10 +57,11 @@ class UserService:
         :param user_id: ID of the user to update
         :param update_data: Dictionary containing the fields to update
         :raises ValueError: If invalid fields or restricted fields are provided
+        :raises BadRequest: If location or the coordinates are malformed
         :return: Updated user as a dictionary
         """
         # Restricted fields that cannot be updated
-        restricted_fields = {"phone", "rating", "role","profile_picture"}
+        restricted_fields = {"phone", "rating", "role","profile_picture", "city_id"}
     
         # Fetch the user from the database
         user = UserService.get_user_by_id(user_id)
@@ -50,24 +77,38 @@ class UserService:
                 raise ValueError(f"Invalid field: {field}")
             if field in restricted_fields:
                 raise ValueError(f"Cannot update restricted field: {field}")
+
+        # City name, matched against the city dimension
+        if update_data.get("location") is not None and not isinstance(update_data["location"], str):
+            raise BadRequest("location must be a string")
+
+        # Coordinates: both or neither, in range (as for courses)
+        update_data = dict(update_data)
+        if "latitude" in update_data or "longitude" in update_data:
+            try:
+                update_data["latitude"], update_data["longitude"] = parse_coordinates(
+                    update_data.get("latitude"), update_data.get("longitude")
+                )
+            except ValueError as e:
+                raise BadRequest(str(e))
     
         # Update allowed fields
         for field, value in update_data.items():
             if hasattr(user, field):
                 setattr(user, field, value)
+        if "location" in update_data:
+            user.city_id = LocationService.get_or_create_city(user.location)
     
+        # Re-index the whole user document (a partial one would drop fields)
+        if {"name", "surname", "location", "latitude", "longitude"} & set(update_data):
+            SearchOutboxService.enqueue_users([user.id])
+        # and the course documents embedding the tutor/academy summary
+        if {"name", "surname"} & set(update_data):
+            SearchOutboxService.enqueue_courses_of_user(user.id)
+
         # Commit changes to the database
         db.session.commit()
-
-        if "name" in update_data or "surname" in update_data:
-            es_update_data = {}
-            if "name" in update_data:
-                es_update_data["name"] = update_data["name"]
-            if "surname" in update_data:
-                es_update_data["surname"] = update_data["surname"]
-            
-            # Update user in Elasticsearch
-            es.index(index="users", id=user_id, document=es_update_data)
+        UserService.invalidate_cached_user(user_id)
         
         # Return updated user as a dictionary
         return user.to_dict()
@@ -87,6 +128,7 @@ class UserService:
         # Создаем имя файла, например user_45.jpg
         filename = secure_filename(f"user_{user_id}.jpg")
         file_path = os.path.join(MEDIA_FOLDER, filename)
+        os.makedirs(MEDIA_FOLDER, exist_ok=True)
         
         # Сохраняем файл
         with open(file_path, 'wb') as f:
@@ -95,7 +137,9 @@ class UserService:
         # Сохраняем путь к картинке в базе (относительный путь или полный)
         path = f"/media/profiles/{filename}"
         user.profile_picture = path
+        SearchOutboxService.enqueue_courses_of_user(user.id)
         db.session.commit()
+        UserService.invalidate_cached_user(user_id)
         
         return {"msg": "Profile picture updated successfully.", "profile_picture": path}
 
@@ -111,29 +155,22 @@ class UserService:
         
         # Обнуляем путь в базе
         user.profile_picture = None
+        SearchOutboxService.enqueue_courses_of_user(user.id)
         db.session.commit()
+        UserService.invalidate_cached_user(user_id)
         
         return {"msg": "Profile picture deleted successfully."}
     
     @staticmethod
     def _attach_favorites(user_id, users):
         """
-        Добавляет к каждому курсу поле is_favorite для текущего пользователя.
-        Выполняет один SQL-запрос для всех курсов.
+        Добавляет к каждому пользователю поле is_favorite для текущего пользователя.
+        Проверка по кэшированному множеству избранного, без запроса к БД.
         """
         if not user_id or not users:
-            return [course.to_dict(is_favorite=False) for course in users]
-
-        # Собираем все course_ids
-        users_ids = [c['id'] for c in users]
-       
-        # Получаем избранные одним запросом
-        favorite_ids = {
-            f.target_user_id for f in Favorites.query.filter(
-                Favorites.user_id == user_id,
-                Favorites.target_user_id.in_(users_ids)
-            ).all()
-        }
+            return [{**c, "is_favorite": False} for c in users]
+
+        favorite_ids = FavoritesService.get_favorite_ids(user_id).user_ids
 
         # Формируем итоговый список
         return [
@@ -142,8 +179,40 @@ class UserService:
         ]
     
     @staticmethod
-    def get_top_users(user_id=None,role=None, location=None, degree=None, min_rating=0, page=1, per_page=10):
-        query = User.query
+    def _get_start_prices(user_ids):
+        """
+        Minimum course price per tutor/academy, for a page of users, in one query.
+        """
+        if not user_ids:
+            return {}
+        owned = union_all(
+            select(Course.tutor_id.label("user_id"), Course.price).where(Course.tutor_id.in_(user_ids)),
+            select(Course.academy_id.label("user_id"), Course.price).where(Course.academy_id.in_(user_ids)),
+        ).subquery()
+        rows = db.session.query(owned.c.user_id, func.min(owned.c.price)).group_by(owned.c.user_id).all()
+        return {owner_id: start_price for owner_id, start_price in rows}
+
+    @staticmethod
+    def _serialize_top_users(users):
+        start_prices = UserService._get_start_prices([user.id for user in users])
+        _users = []
+        for user in users:
+            user_dict = user.course_to_dict()
+            user_dict["course_rating_stats"] = user.get_course_rating_stats()
+
+            # Minimum course price (from tutor and academy roles)
+            start_price = start_prices.get(user.id)
+            user_dict["start_price"] = float(start_price) if start_price is not None else None
+
+            _users.append(user_dict)
+        return _users
+
+    @staticmethod
+    @read_only
+    def get_top_users(user_id=None,role=None, location=None, degree=None, min_rating=0, page=1, per_page=10,
+                      cursor=None, with_total=False, near=None):
+        # Rating rollup comes with the users, no per-user aggregation
+        query = User.query.options(joinedload(User.stats))
 
         # Filter by role
         if role:
@@ -157,45 +226,39 @@ class UserService:
 
         # Optional filters
         if location:
-            query = query.filter(User.location.ilike(f"%{location}%"))
+            # Normalized city name, matched through city_id
+            query = query.filter(LocationService.city_filter(User.city_id, location))
         if degree:
             query = query.filter(User.degree.ilike(f"%{degree}%"))
         if min_rating:
             query = query.filter(User.rating >= min_rating)
+        if near:
+            query = query.filter(within_radius(User.latitude, User.longitude, *near))
+
+        count_filters = {"role": role, "location": location, "degree": degree, "min_rating": min_rating,
+                         "near": near}
+        if cursor is not None:
+            # Keyset pagination on (rating, id), no total count unless asked
+            page_data = keyset_paginate(query, User.rating, User.id, cursor=cursor,
+                                        per_page=per_page, with_total=with_total,
+                                        endpoint="top_users", filters=count_filters)
+            _users = UserService._serialize_top_users(page_data.pop("items"))
+            page_data["users"] = UserService._attach_favorites(user_id=user_id, users=_users)
+            return page_data
 
         # Sort by rating
         query = query.order_by(desc(User.rating))
 
         # Paginate
-        paginated = query.paginate(page=page, per_page=per_page, error_out=False)
+        paginated = paginate(query, page, per_page, endpoint="top_users", filters=count_filters)
 
         # Serialize
-        # _users = [user.course_to_dict() for user in paginated.items]
-        _users = []
-        for user in paginated.items:
-            user_dict = user.course_to_dict()
-
-            # Collect all course prices (from tutor and academy roles)
-            prices = []
-
-            # Courses where user is tutor
-            if user.courses_as_tutor is not None:
-                tutor_courses = user.courses_as_tutor.all()
-                prices.extend([c.price for c in tutor_courses if c.price is not None])
-
-            if user.courses_as_academy is not None:
-                academy_courses = user.courses_as_academy.all()
-                prices.extend([c.price for c in academy_courses if c.price is not None])
-
-            # Compute minimum price
-            start_price = min(prices) if prices else None
-            user_dict["start_price"] = float(start_price) if start_price is not None else None
-
-            _users.append(user_dict)
+        _users = UserService._serialize_top_users(paginated.items)
         users = (UserService._attach_favorites(user_id=user_id,users=_users))
         return {
             "users": users,
             "total": paginated.total,
+            "total_exact": paginated.total_exact,
             "page": paginated.page,
             "pages": paginated.pages,
             "per_page": paginated.per_page,
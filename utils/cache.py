@@ -0,0 +1,262 @@
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from flask import current_app
+from _logger import log
+from utils.metrics import register_metrics
+
+
+class LocalCache:
+    """
+    Thread-safe in-process LRU cache with a per-entry TTL. When full, the
+    least recently used entry is evicted. Expired entries are dropped on
+    access (and counted as misses).
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            value, expires = entry
+            if expires <= now:
+                del self._entries[key]
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCacheBackend(ABC):
+    """
+    Interface of the cache shared by all workers. Values are JSON strings;
+    implementations must be safe to call from several threads.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """Value of `key`, None when missing or expired."""
+
+    @abstractmethod
+    def set(self, key, value, ttl):
+        """Stores `value` under `key` for `ttl` seconds."""
+
+    @abstractmethod
+    def delete(self, *keys):
+        """Drops `keys` (missing ones are ignored)."""
+
+
+class InProcessSharedBackend(SharedCacheBackend):
+    """
+    Local stand-in for the shared backend (development, single worker):
+    same interface, backed by an LRU in this process only.
+    """
+
+    def __init__(self, max_entries=10000):
+        self._cache = LocalCache(max_entries)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl)
+
+    def delete(self, *keys):
+        self._cache.delete(*keys)
+
+
+class RedisCacheBackend(SharedCacheBackend):
+    """Shared backend on Redis (needs the optional `redis` package)."""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl):
+        self._client.set(key, value, ex=max(1, int(ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*keys)
+
+
+class ResponseCache:
+    """
+    Two-level cache of serialized payloads: an in-process LRU in front of
+    an optional shared backend (CACHE_SHARED_URL: "redis://..." or "local"
+    for the in-process stand-in). Local entries live CACHE_LOCAL_TTL
+    seconds, with or without a shared backend, shared ones CACHE_TTL
+    seconds. Writers call invalidate() after their commit; the local TTL
+    bounds how long another worker can serve an entry invalidated
+    elsewhere. invalidate() also bumps a generation (a counter in this
+    process, a token per key in the shared backend), and a loader result
+    is only stored when the generation did not move while it ran, so a
+    read that raced a commit can't put the old payload back for
+    CACHE_TTL. Backend errors are logged and treated as misses, so the
+    cache never fails a request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = None
+        self._shared = None
+        self._configured = False
+        self._invalidated = 0
+        self.counters = {"shared_hits": 0, "shared_misses": 0, "shared_errors": 0, "invalidations": 0,
+                         "stale_fills": 0}
+
+    def _configure(self):
+        if self._configured:
+            return
+        with self._lock:
+            if self._configured:
+                return
+            config = current_app.config
+            self.enabled = config.get("CACHE_ENABLED", True)
+            self.ttl = config.get("CACHE_TTL", 300)
+            self.local_ttl = config.get("CACHE_LOCAL_TTL", 30)
+            self._local = LocalCache(config.get("CACHE_MAX_ENTRIES", 1024))
+
+            shared_url = config.get("CACHE_SHARED_URL")
+            if shared_url == "local":
+                self._shared = InProcessSharedBackend()
+            elif shared_url:
+                self._shared = RedisCacheBackend(shared_url)
+            elif os.getenv("SERVER_SOFTWARE", "").startswith("gunicorn"):
+                log(f"CACHE_SHARED_URL is not set: other workers may serve invalidated payloads "
+                    f"for up to CACHE_LOCAL_TTL ({self.local_ttl}s)")
+            self._configured = True
+
+    def _shared_call(self, method, *args):
+        try:
+            return getattr(self._shared, method)(*args)
+        except Exception as e:
+            self.counters["shared_errors"] += 1
+            log(f"Shared cache {method} failed: {e}")
+            return None
+
+    def _generation(self, key):
+        # Local counter covers this process, the shared token the other workers
+        shared = self._shared_call("get", generation_key(key)) if self._shared is not None else None
+        return self._invalidated, shared
+
+    def get_or_set(self, key, loader):
+        """
+        Returns the cached payload for `key`, or calls loader(), caches its
+        (JSON-serializable) result and returns it.
+        """
+        self._configure()
+        if not self.enabled:
+            return loader()
+
+        value = self._local.get(key)
+        if value is not None:
+            return value
+
+        generation = self._generation(key)
+        if self._shared is not None:
+            raw = self._shared_call("get", key)
+            if raw is not None:
+                self.counters["shared_hits"] += 1
+                value = json.loads(raw)
+                self._local.set(key, value, self.local_ttl)
+                return value
+            self.counters["shared_misses"] += 1
+
+        value = loader()
+        if self._generation(key) != generation:
+            # Invalidated while loading: the value may predate the commit
+            self.counters["stale_fills"] += 1
+            return value
+        self._local.set(key, value, self.local_ttl)
+        if self._shared is not None:
+            self._shared_call("set", key, json.dumps(value), self.ttl)
+        return value
+
+    def invalidate(self, *keys):
+        """Drops `keys` from both levels. Call after the write is committed."""
+        self._configure()
+        keys = [key for key in keys if key]
+        if not keys:
+            return
+        with self._lock:
+            self._invalidated += 1
+        self._local.delete(*keys)
+        if self._shared is not None:
+            token = uuid.uuid4().hex
+            for key in keys:
+                self._shared_call("set", generation_key(key), token, self.ttl)
+            self._shared_call("delete", *keys)
+        self.counters["invalidations"] += len(keys)
+
+    def get_shared(self, key):
+        """Raw string stored under `key` in the shared backend (None without one), for cross-worker flags."""
+        self._configure()
+        return self._shared_call("get", key) if self._shared is not None else None
+
+    def set_shared(self, key, value, ttl):
+        """Stores a raw string in the shared backend only; a no-op without one."""
+        self._configure()
+        if self._shared is not None:
+            self._shared_call("set", key, value, ttl)
+
+    def stats(self):
+        stats = dict(self.counters)
+        if self._local is not None:
+            stats.update(self._local.counters)
+            stats["entries"] = len(self._local)
+        return stats
+
+
+def course_key(course_id):
+    return f"course:{int(course_id)}"
+
+
+def profile_key(user_id):
+    return f"profile:{int(user_id)}"
+
+
+def generation_key(key):
+    return f"generation:{key}"
+
+
+response_cache = ResponseCache()
+register_metrics("response_cache", response_cache.stats)
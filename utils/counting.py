@@ -0,0 +1,88 @@
+import threading
+import time
+from flask import current_app
+from extensions import db
+
+COUNT_EXACT = 'exact'
+COUNT_CACHED = 'cached'
+COUNT_ESTIMATE = 'estimate'
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+_COUNT_CACHE_MAX_ENTRIES = 10000
+
+
+def _count_strategy(endpoint):
+    return current_app.config.get('COUNT_STRATEGIES', {}).get(endpoint, COUNT_EXACT)
+
+
+def _exact_count(query):
+    return query.order_by(None).count()
+
+
+def _cached_count(query, cache_key):
+    """Exact count cached per filter set for COUNT_CACHE_TTL seconds."""
+    now = time.monotonic()
+    with _count_cache_lock:
+        entry = _count_cache.get(cache_key)
+    if entry and entry[1] > now:
+        return entry[0], False
+
+    total = _exact_count(query)
+    with _count_cache_lock:
+        if len(_count_cache) >= _COUNT_CACHE_MAX_ENTRIES:
+            # Drop expired entries, then the oldest ones if still full
+            for key in [key for key, (_, expires) in _count_cache.items() if expires <= now]:
+                del _count_cache[key]
+            while len(_count_cache) >= _COUNT_CACHE_MAX_ENTRIES:
+                del _count_cache[next(iter(_count_cache))]
+        _count_cache[cache_key] = (total, now + current_app.config.get('COUNT_CACHE_TTL', 60))
+    return total, True
+
+
+def _planner_estimate(query):
+    """Row estimate of the query's plan from PostgreSQL EXPLAIN, None if unavailable."""
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+    # render_postcompile expands IN (...) lists into one bound parameter per value
+    compiled = query.enable_eagerloads(False).order_by(None).statement.compile(
+        dialect=connection.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_total(query, endpoint, filters=None):
+    """
+    Total row count of `query` using the strategy configured for `endpoint`
+    in COUNT_STRATEGIES:
+    - 'exact': COUNT(*) on every call (default).
+    - 'cached': exact COUNT(*) cached for COUNT_CACHE_TTL seconds, keyed by
+      the endpoint and its filter set.
+    - 'estimate': the planner's row estimate when it is at least
+      COUNT_ESTIMATE_THRESHOLD, exact COUNT(*) below that.
+    Returns (total, exact) where exact tells whether total is a fresh exact count.
+    """
+    strategy = _count_strategy(endpoint)
+
+    if strategy == COUNT_CACHED:
+        cache_key = (endpoint,) + tuple(sorted((filters or {}).items()))
+        return _cached_count(query, cache_key)
+
+    if strategy == COUNT_ESTIMATE:
+        estimate = _planner_estimate(query)
+        if estimate is not None and estimate >= current_app.config.get('COUNT_ESTIMATE_THRESHOLD', 10000):
+            return estimate, False
+
+    return _exact_count(query), True
+
+
+def paginate(query, page, per_page, endpoint, filters=None):
+    """
+    Flask-SQLAlchemy paginate() with the total computed by count_total().
+    The returned Pagination also carries `total_exact`.
+    """
+    paginated = query.paginate(page=page, per_page=per_page, error_out=False, count=False)
+    paginated.total, paginated.total_exact = count_total(query, endpoint, filters)
+    return paginated
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool, NullPool
+from utils.metrics import register_metrics
+
+# Threads of a worker that hold a connection besides the request threads:
+# page view buffer, search outbox dispatcher, rating recompute timer
+BACKGROUND_THREADS = 3
+
+
+def gunicorn_worker_count():
+    """Default gunicorn worker count (2 x CPUs available + 1), or GUNICORN_WORKERS."""
+    if os.getenv("GUNICORN_WORKERS"):
+        return int(os.getenv("GUNICORN_WORKERS"))
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return cpus * 2 + 1
+
+
+class _TimedCheckout:
+    """Counts checkouts and the time spent waiting for them (pool wait, connect, pre-ping)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+
+    def connect(self):
+        started = time.monotonic()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+        finally:
+            waited = (time.monotonic() - started) * 1000
+            with self._stats_lock:
+                self._checkouts += 1
+                self._wait_ms_total += waited
+                self._wait_ms_max = max(self._wait_ms_max, waited)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = {
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._wait_ms_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "max_wait_ms": round(self._wait_ms_max, 3),
+            }
+        if isinstance(self, QueuePool):
+            stats.update({
+                "size": self.size(),
+                "checked_in": self.checkedin(),
+                "checked_out": self.checkedout(),
+                # Negative while the pool is below pool_size, > 0 when borrowing from max_overflow
+                "overflow": self.overflow(),
+                "max_overflow": self._max_overflow,
+            })
+        return stats
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+def pool_sizing(max_connections, reserved, workers, threads):
+    """
+    (pool_size, max_overflow) of one worker: the workers share
+    max_connections - reserved client connections, and a worker never
+    needs more than one connection per thread.
+    """
+    budget = max(1, (max_connections - reserved) // max(workers, 1))
+    pool_size = max(1, min(threads, budget))
+    return pool_size, budget - pool_size
+
+
+def _behind_pgbouncer(url, setting):
+    if setting in ("true", "false"):
+        return setting == "true"
+    # auto: pgbouncer's default port or host name
+    return url.port == 6432 or "pgbouncer" in (url.host or "")
+
+
+def engine_options(database_url, mode="queue", behind_pgbouncer="auto", max_connections=100, reserved=10,
+                   workers=None, threads=None, pool_size=None, pool_timeout=10, pool_recycle=1800,
+                   pre_ping=True):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for Postgres (empty for other databases).
+
+    mode 'queue' keeps a small pool per worker, sized from the connection
+    limit (pgbouncer max_client_conn, or Postgres max_connections when
+    connecting directly) shared by all workers; 'null' opens a connection
+    per checkout and leaves pooling to pgbouncer. Behind pgbouncer in
+    transaction mode, drivers that prepare statements server side get
+    their statement caches disabled (a prepared statement lives on one
+    server connection, the next transaction may run on another).
+    """
+    url = make_url(database_url)
+    if url.get_backend_name() != "postgresql":
+        return {}
+
+    options = {"pool_pre_ping": pre_ping}
+    if mode == "null":
+        options["poolclass"] = TimedNullPool
+    else:
+        if threads is None:
+            # Requests served concurrently by one worker (see gunicorn.conf.py)
+            worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+            threads = {"sync": 1, "gevent": max_connections}.get(worker_class, int(os.getenv("GUNICORN_THREADS", 4)))
+            threads += BACKGROUND_THREADS
+        size, overflow = pool_sizing(max_connections, reserved, workers or gunicorn_worker_count(), threads)
+        if pool_size is not None:
+            size, overflow = pool_size, max(0, size + overflow - pool_size)
+        options.update({
+            "poolclass": TimedQueuePool,
+            "pool_size": size,
+            "max_overflow": overflow,
+            "pool_timeout": pool_timeout,
+            "pool_recycle": pool_recycle,
+            # Reuse the most recent connection so idle ones can time out
+            "pool_use_lifo": True,
+        })
+
+    if _behind_pgbouncer(url, behind_pgbouncer):
+        driver = url.get_driver_name()
+        if driver == "psycopg":
+            options["connect_args"] = {"prepare_threshold": None}
+        elif driver == "asyncpg":
+            options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+        # psycopg2 never prepares statements server side
+    return options
+
+
+def replica_binds(replica_urls, **options):
+    """SQLALCHEMY_BINDS of the read replicas (replica_0, replica_1, ...), see utils/db_routing.py."""
+    return {
+        f"replica_{index}": {"url": url, **engine_options(url, **options)}
+        for index, url in enumerate(replica_urls)
+    }
+
+
+def register_pool_metrics(app, db):
+    """Exposes the pool of every engine of `app` in /metrics (db_pool, db_pool_<bind>)."""
+    with app.app_context():
+        engines = dict(db.engines)
+    for bind_key, engine in engines.items():
+        name = "db_pool" if bind_key is None else f"db_pool_{bind_key}"
+        # engine.pool is read on every scrape: dispose() (post_fork) replaces it
+        register_metrics(name, lambda engine=engine: engine.pool.stats() if hasattr(engine.pool, "stats") else {})
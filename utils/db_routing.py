@@ -0,0 +1,200 @@
+"""
+Read replica routing for db.session.
+
+Replicas are the SQLALCHEMY_BINDS named replica_<n> (built from
+DATABASE_REPLICA_URLS, see utils/db_pool.replica_binds). Queries run
+inside a @read_only service method go to one replica per session
+(request); everything else goes to the primary:
+
+- flushes, INSERT/UPDATE/DELETE and SELECT ... FOR UPDATE;
+- any query of a session that already wrote (read-your-own-writes
+  within the request);
+- the requests of a user for DB_REPLICA_STICKY_SECONDS after they
+  committed a write (shared between workers through CACHE_SHARED_URL);
+- reads when every replica lags more than DB_REPLICA_MAX_LAG_SECONDS or
+  cannot be reached. Lag is checked at most every
+  DB_REPLICA_LAG_CHECK_INTERVAL seconds per replica.
+
+Only models of the default bind are routed (the app has no others).
+"""
+import contextlib
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from flask import current_app, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+from _logger import log
+from utils.cache import LocalCache, response_cache
+from utils.metrics import register_metrics
+
+REPLICA_BIND_PREFIX = "replica_"
+
+# Seconds since the last replayed transaction, 0 when the replica has replayed all it received
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+_read_only = contextvars.ContextVar("db_read_only", default=False)
+
+
+def read_only(func):
+    """Lets the queries of `func` run on a replica (put it under @staticmethod)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _read_only.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _read_only.reset(token)
+    return wrapper
+
+
+@contextlib.contextmanager
+def use_primary():
+    """Runs the queries of the block on the primary, also inside a @read_only method."""
+    token = _read_only.set(False)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def _replica_keys(engines):
+    return [key for key in engines if key and key.startswith(REPLICA_BIND_PREFIX)]
+
+
+def _is_write(clause):
+    return clause is not None and (
+        getattr(clause, "is_dml", False) or getattr(clause, "_for_update_arg", None) is not None
+    )
+
+
+def _current_identity():
+    """JWT identity of the current request, None outside requests or without a verified token."""
+    if not has_request_context():
+        return None
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+class ReplicaRouter:
+    """
+    Picks a replica for a session and pins writers to the primary. Replica
+    lag is cached per bind; one thread refreshes it while the others keep
+    using the last result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lag = {}  # bind key -> (lag in seconds or None when unreachable, monotonic time of the check)
+        self._pins = LocalCache(max_entries=10000)
+        self.counters = {"replica_sessions": 0, "pinned_sessions": 0, "lag_fallbacks": 0, "check_errors": 0}
+        # A lock held by another thread at fork time would stay locked in the child
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def _check_lag(self, key, engine):
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == "postgresql":
+                    lag = float(connection.execute(REPLICA_LAG_SQL).scalar() or 0)
+                else:
+                    lag = 0.0
+        except SQLAlchemyError as e:
+            self.counters["check_errors"] += 1
+            log(f"Replica {key} unavailable, reads go to the primary: {e}")
+            lag = None
+        self._lag[key] = (lag, time.monotonic())
+
+    def _usable(self, key, engine):
+        config = current_app.config
+        checked = self._lag.get(key)
+        if checked is None or time.monotonic() - checked[1] >= config.get("DB_REPLICA_LAG_CHECK_INTERVAL", 1.0):
+            # Wait for the very first check only
+            if self._lock.acquire(blocking=checked is None):
+                try:
+                    if self._lag.get(key) is checked:
+                        self._check_lag(key, engine)
+                finally:
+                    self._lock.release()
+            checked = self._lag[key]
+        lag = checked[0]
+        return lag is not None and lag <= config.get("DB_REPLICA_MAX_LAG_SECONDS", 2.0)
+
+    def pick(self, engines):
+        """Replica engine for a new read-only session, None to stay on the primary."""
+        keys = _replica_keys(engines)
+        if not keys:
+            return None
+        if self.is_pinned(_current_identity()):
+            self.counters["pinned_sessions"] += 1
+            return None
+        usable = [key for key in keys if self._usable(key, engines[key])]
+        if not usable:
+            self.counters["lag_fallbacks"] += 1
+            return None
+        self.counters["replica_sessions"] += 1
+        return engines[random.choice(usable)]
+
+    def pin(self, identity):
+        """Sends the reads of `identity` to the primary for DB_REPLICA_STICKY_SECONDS."""
+        seconds = current_app.config.get("DB_REPLICA_STICKY_SECONDS", 5.0)
+        self._pins.set(str(identity), True, seconds)
+        response_cache.set_shared(f"db_primary:{identity}", "1", seconds)
+
+    def is_pinned(self, identity):
+        if identity is None:
+            return False
+        return bool(self._pins.get(str(identity))) or response_cache.get_shared(f"db_primary:{identity}") is not None
+
+    def stats(self):
+        stats = dict(self.counters)
+        for key, (lag, _) in list(self._lag.items()):
+            stats[f"{key}_lag_seconds"] = lag
+        return stats
+
+
+router = ReplicaRouter()
+register_metrics("db_replicas", router.stats)
+
+
+class RoutingSession(Session):
+    """db.session class: primary by default, a replica for @read_only queries (see module docstring)."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            if self._flushing or _is_write(clause):
+                self.info["db_wrote"] = True
+            elif _read_only.get():
+                replica = self._replica()
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica(self):
+        if self.info.get("db_wrote"):
+            return None
+        # Chosen once, so the reads of a request see one consistent snapshot source
+        if "db_replica" not in self.info:
+            self.info["db_replica"] = router.pick(self._db.engines)
+        return self.info["db_replica"]
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _pin_writer(session):
+    if session.info.get("db_wrote") and _replica_keys(session._db.engines):
+        identity = _current_identity()
+        if identity is not None:
+            router.pin(identity)
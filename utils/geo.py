@@ -0,0 +1,83 @@
+import math
+from sqlalchemy import and_, func
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def parse_near(args):
+    """
+    Reads the optional "near me" arguments from request.args: `lat`, `lon`
+    and `radius_km` (default 10). Returns (lat, lon, radius_km) or None when
+    no coordinates are given; raises ValueError on invalid values.
+    """
+    lat, lon = args.get('lat'), args.get('lon')
+    if lat is None and lon is None:
+        return None
+    if lat is None or lon is None:
+        raise ValueError("Both lat and lon are required")
+    lat, lon, radius_km = float(lat), float(lon), float(args.get('radius_km', 10))
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise ValueError("Invalid coordinates")
+    if not 0 < radius_km <= 500:
+        raise ValueError("radius_km must be between 0 and 500")
+    return lat, lon, radius_km
+
+
+def parse_coordinates(latitude, longitude):
+    """
+    (latitude, longitude) as floats for a course/user update, (None, None)
+    to clear them; raises ValueError when only one is given or either is
+    out of range.
+    """
+    if latitude is None and longitude is None:
+        return None, None
+    if latitude is None or longitude is None:
+        raise ValueError("Both latitude and longitude are required")
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid coordinates")
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError("Invalid coordinates")
+    return latitude, longitude
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    (min_lat, max_lat, min_lon, max_lon) of the box enclosing the circle.
+    Longitude bounds are None when the box reaches a pole or crosses the
+    antimeridian (no longitude prefilter then).
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None, None
+
+    delta_lon = math.degrees(math.asin(math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat))))
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def distance_km(lat_column, lon_column, lat, lon):
+    """Haversine distance in km between the row's coordinates and (lat, lon), as a SQL expression."""
+    dlat = func.radians(lat_column - lat)
+    dlon = func.radians(lon_column - lon)
+    a = (func.power(func.sin(dlat / 2.0), 2)
+         + math.cos(math.radians(lat)) * func.cos(func.radians(lat_column)) * func.power(func.sin(dlon / 2.0), 2))
+    return 2 * EARTH_RADIUS_KM * func.asin(func.sqrt(func.least(a, 1.0)))
+
+
+def within_radius(lat_column, lon_column, lat, lon, radius_km):
+    """
+    Filter for rows within radius_km of (lat, lon): a bounding-box range on
+    the (latitude, longitude) index narrows the rows, the haversine distance
+    is exact.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    conditions = [lat_column.between(min_lat, max_lat)]
+    if min_lon is not None:
+        conditions.append(lon_column.between(min_lon, max_lon))
+    conditions.append(distance_km(lat_column, lon_column, lat, lon) <= radius_km)
+    return and_(*conditions)
@@ -0,0 +1,58 @@
+import hashlib
+import math
+
+DEFAULT_PRECISION = 11  # 2048 one-byte registers, ~2.3% standard error
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality sketch with dense one-byte registers.
+    Sketches of the same precision merge by register-wise max, so the
+    union of any number of sketches is counted in fixed memory.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            self.registers = bytearray(self.m)
+        else:
+            if len(registers) != self.m:
+                raise ValueError("Register size does not match the sketch precision")
+            self.registers = bytearray(registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(precision=int(math.log2(len(data))), registers=data)
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @staticmethod
+    def _hash(value):
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def add(self, value):
+        hashed = self._hash(value)
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1-bit in the remaining 64 - p bits
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Small range correction (linear counting)
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
@@ -0,0 +1,20 @@
+import threading
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def register_metrics(name, collector):
+    """
+    Registers a metrics source: `collector` is called on every scrape and
+    returns a JSON-serializable dict of counters/gauges.
+    """
+    with _sources_lock:
+        _sources[name] = collector
+
+
+def collect_metrics():
+    """Snapshot of every registered metrics source, keyed by name."""
+    with _sources_lock:
+        sources = dict(_sources)
+    return {name: collector() for name, collector in sources.items()}
@@ -0,0 +1,80 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+from utils.counting import count_total
+
+
+def encode_cursor(sort_value, row_id):
+    """Opaque cursor for the (sort key, id) position of a row."""
+    if isinstance(sort_value, datetime):
+        sort_value = {"dt": sort_value.isoformat()}
+    payload = json.dumps([sort_value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns (sort value, id) from a cursor made by encode_cursor()."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if isinstance(sort_value, dict):
+            sort_value = datetime.fromisoformat(sort_value["dt"])
+        return sort_value, int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, per_page=10, descending=True, with_total=False,
+                    endpoint=None, filters=None):
+    """
+    Keyset (cursor) pagination of `query` ordered by (sort_column, id_column).
+    Each page is a range scan starting after the cursor position, so deep
+    pages cost the same as the first one, and the total count is only run
+    when with_total is set (with the count strategy of `endpoint`, see
+    utils.counting). sort_column must not contain NULLs.
+
+    An empty/None cursor returns the first page. Returns:
+    { "items": [...], "next_cursor": str or None, "per_page": int,
+      ["total": int, "total_exact": bool] }
+    """
+    result = {}
+    if with_total:
+        result["total"], result["total_exact"] = count_total(query, endpoint, filters)
+
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        position = tuple_(sort_column, id_column)
+        query = query.filter(position < tuple_(sort_value, row_id) if descending else position > tuple_(sort_value, row_id))
+
+    if descending:
+        query = query.order_by(None).order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(None).order_by(sort_column.asc(), id_column.asc())
+
+    # One extra row tells whether there is a next page
+    rows = query.limit(per_page + 1).all()
+    items = rows[:per_page]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+
+    result.update({
+        "items": items,
+        "next_cursor": next_cursor,
+        "per_page": per_page,
+    })
+    return result
+
+
+def cursor_args(args):
+    """
+    Reads the opt-in keyset pagination arguments from request.args:
+    `cursor` (present, even empty, switches a listing to cursor mode) and
+    `with_total` (also run the total count).
+    """
+    cursor = args.get('cursor', None)
+    with_total = args.get('with_total', 'false').lower() in ['true', '1', 'yes']
+    return cursor, with_total